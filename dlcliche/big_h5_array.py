@@ -1,33 +1,796 @@
 # Based on https://stackoverflow.com/questions/30376581/save-numpy-array-in-append-mode
 import tables
 import numpy as np
+from pathlib import Path
+import threading
+import queue
+from multiprocessing import Pool, Process, Queue
+
+# Short names for compression libraries, ex) complib='zstd' is 'blosc:zstd'.
+_COMPLIB_ALIASES = {
+    'lz4': 'blosc:lz4',
+    'lz4hc': 'blosc:lz4hc',
+    'zstd': 'blosc:zstd',
+    'blosclz': 'blosc:blosclz',
+}
+
+
+def h5_filters(complib=None, complevel=5, shuffle=True):
+    """Make tables.Filters for the compression library.
+
+    Arguments:
+        complib: One of tables.filters.all_complibs ('zlib', 'blosc:zstd', 'blosc:lz4', ...),
+            or short name 'zstd', 'lz4', 'lz4hc' and 'blosclz' for blosc ones.
+            None will return None, i.e. no compression.
+        complevel: Compression level 1-9.
+        shuffle: Use byte shuffle filter, usually improves ratio of float data.
+    """
+    if complib is None:
+        return None
+    complib = _COMPLIB_ALIASES.get(complib, complib)
+    if complib not in tables.filters.all_complibs:
+        raise ValueError('Unknown complib: {}, choose from {}'.format(complib, tables.filters.all_complibs))
+    return tables.Filters(complevel=complevel, complib=complib, shuffle=shuffle)
+
+
+def auto_chunkshape(shape, itemsize, batch_rows=64, max_chunk_bytes=1024*1024):
+    """Calculate row-major chunkshape so that a chunk holds whole rows.
+
+    A chunk will have up to `batch_rows` rows, which is expected to be typical
+    number of rows read at once, limited by `max_chunk_bytes`.
+    If a single row is larger than `max_chunk_bytes`, the row will be split
+    along the following axes.
+
+    Arguments:
+        shape: Array shape, the first axis is rows. 0 is fine for expandable.
+        itemsize: Bytes of one element, ex) tables.Float32Atom().itemsize.
+        batch_rows: Typical number of rows to read at once.
+        max_chunk_bytes: Upper limit of chunk size in bytes.
+    """
+    row_shape = [max(1, int(d)) for d in shape[1:]]
+    row_bytes = int(np.prod(row_shape)) * itemsize
+    n_rows = max(1, min(batch_rows, max_chunk_bytes // max(1, row_bytes)))
+    if 0 < shape[0]:
+        n_rows = min(n_rows, int(shape[0]))
+    # Split a row if it is too big
+    for axis in range(len(row_shape)):
+        if int(np.prod(row_shape)) * itemsize <= max_chunk_bytes:
+            break
+        rest = int(np.prod(row_shape[axis+1:])) * itemsize
+        row_shape[axis] = max(1, min(row_shape[axis], max_chunk_bytes // max(1, rest)))
+    return tuple([n_rows] + row_shape)
+
+
+def _h5_open(filename, mode, chunk_cache_size=None):
+    params = {} if chunk_cache_size is None else {'chunk_cache_size': chunk_cache_size}
+    return tables.open_file(filename, mode=mode, **params)
+
 
 class BigH5Array():
-    def __init__(self, filename, shape=None, atom=tables.Float32Atom()):
+    """Big numpy-like array stored in HDF5 file.
+
+    Arguments:
+        filename: HDF5 filename.
+        shape: Array shape, needed for writing.
+        atom: Element type.
+        chunkshape: Chunk shape, None is PyTables default, or 'auto' to use auto_chunkshape().
+        complib: Compression library, see h5_filters(). None will not compress.
+        complevel: Compression level.
+        shuffle: Use byte shuffle filter with compression.
+        chunk_cache_size: HDF5 chunk cache size in bytes, None is PyTables default.
+        batch_rows: Typical number of rows to read at once, used when chunkshape='auto'.
+    """
+    def __init__(self, filename, shape=None, atom=tables.Float32Atom(), chunkshape=None,
+                 complib=None, complevel=5, shuffle=True, chunk_cache_size=None, batch_rows=64):
         self.filename = filename
         self.shape = shape
         self.atom = atom
-    def open_for_write(self):
-        self.f = tables.open_file(self.filename, mode='w')
-        self.array_c = self.f.create_carray(self.f.root, 'carray', self.atom, self.shape)
-    def open_for_write_expandable(self):
-        self.f = tables.open_file(self.filename, mode='w')
-        self.array_e = self.f.create_earray(self.f.root, 'data', self.atom, [0] + list(self.shape[1:]))
+        self.chunkshape = chunkshape
+        self.filters = h5_filters(complib, complevel=complevel, shuffle=shuffle)
+        self.chunk_cache_size = chunk_cache_size
+        self.batch_rows = batch_rows
+    def _open(self, mode):
+        self.f = _h5_open(self.filename, mode, self.chunk_cache_size)
+        self._buf, self._n_buf = None, 0
+    def _chunkshape(self, shape):
+        if self.chunkshape == 'auto':
+            return auto_chunkshape(shape, self.atom.itemsize, batch_rows=self.batch_rows)
+        return self.chunkshape
+    def open_for_write(self, contiguous=False):
+        """Open for writing random access array.
+        contiguous=True makes uncompressed non-chunked array that can be memory mapped,
+        see BigH5LazyArray."""
+        self._open('w')
+        if contiguous:
+            self.array_c = self.f.create_array(self.f.root, 'carray', atom=self.atom, shape=self.shape)
+            return
+        self.array_c = self.f.create_carray(self.f.root, 'carray', self.atom, self.shape,
+                                            filters=self.filters, chunkshape=self._chunkshape(self.shape))
+    def open_for_write_expandable(self, buffer_rows=None):
+        """Open for writing expandable array.
+
+        Arguments:
+            buffer_rows: Rows appended are buffered and written at once when buffer gets full.
+                'chunk' makes the buffer as large as a chunk, 0 or None (default) will not buffer.
+                Buffered rows are written by flush() or close(), make sure to call either of them.
+        """
+        self._open('w')
+        shape = [0] + list(self.shape[1:])
+        self.array_e = self.f.create_earray(self.f.root, 'data', self.atom, shape,
+                                            filters=self.filters, chunkshape=self._chunkshape(shape))
+        if buffer_rows == 'chunk':
+            buffer_rows = self.array_e.chunkshape[0]
+        if buffer_rows:
+            self._buf = np.empty([buffer_rows] + shape[1:], dtype=self.array_e.atom.dtype)
     def open_for_read(self):
-        self.f = tables.open_file(self.filename, mode='r')
+        self._open('r')
     def data(self): # for expandable
         # bigarray.data()[1:10,2:20]
         return self.f.root.data
     def append(self, row_data): # for expandable
-        self.array_e.append(row_data)
+        """Append rows, or a row without the first axis."""
+        row_data = np.asarray(row_data)
+        if row_data.ndim == len(self.array_e.shape) - 1:
+            row_data = row_data[np.newaxis]
+        if self._buf is None:
+            self.array_e.append(row_data)
+            return
+        done = 0
+        while done < len(row_data):
+            if self._n_buf == 0 and len(self._buf) <= len(row_data) - done:
+                # Large enough to append directly
+                take = (len(row_data) - done) // len(self._buf) * len(self._buf)
+                self.array_e.append(row_data[done:done+take])
+                done += take
+                continue
+            take = min(len(self._buf) - self._n_buf, len(row_data) - done)
+            self._buf[self._n_buf:self._n_buf+take] = row_data[done:done+take]
+            self._n_buf += take
+            done += take
+            if self._n_buf == len(self._buf):
+                self.flush()
+    def flush(self):
+        """Write buffered rows."""
+        if self._buf is not None and 0 < self._n_buf:
+            self.array_e.append(self._buf[:self._n_buf])
+            self._n_buf = 0
+        self.f.flush()
     def __call__(self): # for random access
         return self.f.root.carray
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+    def close(self):
+        if self.f.isopen and self.f.mode != 'r':
+            self.flush()
+        self.f.close()
+
+
+def _h5_default_node(f):
+    return f.root.carray if 'carray' in f.root else f.root.data
+
+
+def _h5_normalize_index(index, n_rows):
+    """Make fancy index (list of row numbers or boolean mask) to be 1d non-negative int array."""
+    index = np.asarray(index)
+    if index.dtype == bool:
+        if len(index) != n_rows:
+            raise IndexError('Boolean index length {} != {}'.format(len(index), n_rows))
+        index = np.nonzero(index)[0]
+    index = index.astype(np.int64).ravel()
+    index = np.where(index < 0, index + n_rows, index)
+    if 0 < len(index) and (index.min() < 0 or n_rows <= index.max()):
+        raise IndexError('Index out of range')
+    return index
+
+
+def h5_read_rows(node, index):
+    """Read rows of HDF5 node (or any array) by fancy index, list of row numbers or boolean mask.
+    Indices are sorted and read as contiguous runs, then returned in requested order.
+    """
+    index = _h5_normalize_index(index, node.shape[0])
+    rows, inverse = np.unique(index, return_inverse=True)
+    runs = np.split(rows, np.nonzero(np.diff(rows) != 1)[0] + 1) if 0 < len(rows) else []
+    parts = [node[run[0]:run[-1]+1] for run in runs]
+    data = np.concatenate(parts) if parts else np.empty((0,) + tuple(node.shape[1:]), dtype=node.dtype)
+    return data if len(rows) == len(index) and np.all(rows == index) else data[inverse]
+
+
+def _h5_memmap(filename, node):
+    """Make read-only np.memmap of contiguous uncompressed node, or None if impossible."""
+    if node.chunkshape is not None or node.filters.complevel != 0 or 0 in node.shape:
+        return None
+    import h5py
+    with h5py.File(filename, 'r') as f:
+        offset = f[node._v_pathname].id.get_offset()
+    if offset is None:
+        return None
+    return np.memmap(filename, dtype=node.dtype, mode='r', offset=offset, shape=tuple(node.shape))
+
+
+class BigH5LazyArray():
+    """Read-only array-like view of BigH5Array file that reads requested rows only.
+
+    Supports `a[3]`, `a[10:20, 2:5]`, `a[[5, 1, 3]]`, `a[bool_mask]`, `len(a)`, `a.shape` and `a.dtype`.
+    Fancy indices are read by h5_read_rows().
+
+    Arguments:
+        filename: HDF5 filename.
+        node: Node name, None will find BigH5Array's 'carray' or 'data'.
+        mmap: Use np.memmap for zero-copy reads if data is contiguous and uncompressed,
+            i.e. written by `open_for_write(contiguous=True)`. Requires h5py.
+            Falls back to normal reads otherwise.
+        chunk_cache_size: HDF5 chunk cache size in bytes.
+    """
+    def __init__(self, filename, node=None, mmap=False, chunk_cache_size=None):
+        self.filename = filename
+        self.f = _h5_open(filename, 'r', chunk_cache_size)
+        self.node = _h5_default_node(self.f) if node is None else self.f.get_node(self.f.root, node)
+        self.mm = _h5_memmap(filename, self.node) if mmap else None
+    @property
+    def shape(self):
+        return tuple(self.node.shape)
+    @property
+    def dtype(self):
+        return self.node.dtype
+    @property
+    def chunkshape(self):
+        return self.node.chunkshape
+    def __len__(self):
+        return self.shape[0]
+    def __getitem__(self, key):
+        if self.mm is not None:
+            return self.mm[key]
+        rows, rest = (key[0], key[1:]) if isinstance(key, tuple) and 0 < len(key) else (key, ())
+        if isinstance(rows, (list, np.ndarray)):
+            data = self.read_rows(rows)
+            return data[(slice(None),) + tuple(rest)] if rest else data
+        return self.node[key]
+    def read_rows(self, index):
+        """Read rows by fancy index (list of row numbers or boolean mask)."""
+        return h5_read_rows(self.node, index)
+    def __array__(self, dtype=None):
+        data = self.node[:] if self.mm is None else np.array(self.mm)
+        return data if dtype is None else data.astype(dtype)
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
     def close(self):
+        self.mm = None
         self.f.close()
 
-def big_h5_load(filename):
+
+def big_h5_load(filename, lazy=False, mmap=False):
+    """Load BigH5Array file.
+
+    Arguments:
+        lazy: Return BigH5LazyArray that reads requested rows only instead of loading all on memory.
+            Call close() when done.
+        mmap: Use memory map for lazy array if possible, see BigH5LazyArray.
+    """
+    if lazy:
+        return BigH5LazyArray(filename, mmap=mmap)
     bigfile = BigH5Array(filename)
     bigfile.open_for_read()
-    bigarray = np.array(bigfile())
+    bigarray = np.array(_h5_default_node(bigfile.f))
     bigfile.close()
     return bigarray
+
+
+class BigH5BatchIterator():
+    """Mini-batch iterator over BigH5Array file with background prefetch.
+
+    Rows are shuffled by chunk so that reads stay chunk-aligned:
+    chunk order is shuffled, each chunk of a window of `shuffle_chunks` chunks is read at once,
+    then rows of the window are shuffled and sliced into batches in memory.
+    Next `prefetch` batches are read in a background thread while caller computes.
+
+    Example:
+        ```python
+        for X in BigH5BatchIterator('train.h5', batch_size=256, shuffle=True):
+            train_on(X)
+        ```
+
+    Arguments:
+        source: Filename, BigH5LazyArray or opened BigH5Array.
+        batch_size: Number of rows in a batch.
+        shuffle: Shuffle rows by chunk if True, or read sequentially.
+        shuffle_chunks: Number of chunks to shuffle rows together.
+        prefetch: Number of batches to read ahead, 0 will read in caller thread.
+        drop_last: Drop last batch if it is smaller than batch_size.
+        with_index: Yield (row index, batch) tuples instead of batch.
+        random_state: Seed for shuffling.
+    """
+    def __init__(self, source, batch_size=64, shuffle=False, shuffle_chunks=4, prefetch=2,
+                 drop_last=False, with_index=False, random_state=None):
+        self.lazy = BigH5LazyArray(source) if isinstance(source, (str, Path)) else None
+        if self.lazy is not None:
+            self.node = self.lazy.node
+        elif isinstance(source, BigH5Array):
+            self.node = _h5_default_node(source.f)
+        else:
+            self.node = source.node
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.shuffle_chunks = shuffle_chunks
+        self.prefetch = prefetch
+        self.drop_last = drop_last
+        self.with_index = with_index
+        self.rng = np.random.RandomState(random_state)
+    def __len__(self):
+        n = self.node.shape[0]
+        return n // self.batch_size if self.drop_last else int(np.ceil(n / self.batch_size))
+    def _windows(self):
+        """Yield (row index, rows) of each shuffle window, reading every chunk at once."""
+        n = self.node.shape[0]
+        chunk_rows = self.node.chunkshape[0] if self.node.chunkshape is not None else self.batch_size
+        starts = np.arange(0, n, chunk_rows)
+        self.rng.shuffle(starts)
+        for i in range(0, len(starts), self.shuffle_chunks):
+            window = starts[i:i+self.shuffle_chunks]
+            index = np.concatenate([np.arange(s, min(s + chunk_rows, n)) for s in window])
+            rows = np.concatenate([self.node[s:s + chunk_rows] for s in window])
+            perm = self.rng.permutation(len(index))
+            yield index[perm], rows[perm]
+    def _batches(self):
+        if not self.shuffle:
+            n = self.node.shape[0]
+            for i in range(0, n, self.batch_size):
+                if self.drop_last and n - i < self.batch_size:
+                    break
+                index = np.arange(i, min(i + self.batch_size, n))
+                yield self._item(index, self.node[i:i+self.batch_size])
+            return
+        # Shuffled rows are sliced in memory, carrying the remainder over to the next window
+        rest_index, rest_rows = None, None
+        for index, rows in self._windows():
+            if rest_index is not None:
+                index, rows = np.concatenate([rest_index, index]), np.concatenate([rest_rows, rows])
+            n_full = len(index) // self.batch_size * self.batch_size
+            for i in range(0, n_full, self.batch_size):
+                yield self._item(index[i:i+self.batch_size], rows[i:i+self.batch_size])
+            rest_index, rest_rows = index[n_full:], rows[n_full:]
+        if rest_index is not None and len(rest_index) > 0 and not self.drop_last:
+            yield self._item(rest_index, rest_rows)
+    def _item(self, index, batch):
+        return (index, batch) if self.with_index else batch
+    def _producer(self, q, stop):
+        try:
+            for item in self._batches():
+                if stop.is_set():
+                    return
+                q.put(item)
+        except Exception as e:
+            q.put(_BatchError(e))
+        q.put(None)
+    def __iter__(self):
+        if self.prefetch <= 0:
+            yield from self._batches()
+            return
+        q = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._producer, args=(q, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = q.get()
+                if item is None:
+                    break
+                if isinstance(item, _BatchError):
+                    raise item.error
+                yield item
+        finally:
+            stop.set()
+            while thread.is_alive():  # unblock producer waiting on full queue
+                try:
+                    q.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+    def close(self):
+        if self.lazy is not None:
+            self.lazy.close()
+
+
+class _BatchError():
+    def __init__(self, error):
+        self.error = error
+
+
+class BigH5Store():
+    """Multiple named datasets with aligned rows in one HDF5 file, ex) features, labels and ids.
+
+    Datasets are expandable, created at the first append() with dtype and row shape of given arrays.
+    Note that PyTables doesn't support unicode str, use bytes (ex. `ids.astype('S')`) instead.
+
+    Example:
+        ```python
+        store = BigH5Store('train.h5', complib='zstd')
+        store.open_for_write()
+        store.append(X=X, y=y, ids=ids)
+        store.close()
+
+        store.open_for_read()
+        batch = store.read_rows([3, 1, 4])  # {'X': ..., 'y': ..., 'ids': ...}
+        ```
+
+    Arguments:
+        filename: HDF5 filename.
+        chunkshape, complib, complevel, shuffle, chunk_cache_size, batch_rows:
+            Same as BigH5Array, applied to all datasets.
+    """
+    def __init__(self, filename, chunkshape=None, complib=None, complevel=5, shuffle=True,
+                 chunk_cache_size=None, batch_rows=64):
+        self.filename = filename
+        self.chunkshape = chunkshape
+        self.filters = h5_filters(complib, complevel=complevel, shuffle=shuffle)
+        self.chunk_cache_size = chunk_cache_size
+        self.batch_rows = batch_rows
+    def open_for_write(self):
+        self.f = _h5_open(self.filename, 'w', self.chunk_cache_size)
+    def open_for_append(self):
+        self.f = _h5_open(self.filename, 'a', self.chunk_cache_size)
+    def open_for_read(self):
+        self.f = _h5_open(self.filename, 'r', self.chunk_cache_size)
+    def names(self):
+        """Dataset names."""
+        return [node._v_name for node in self.f.list_nodes(self.f.root)]
+    def __getitem__(self, name):
+        return self.f.get_node(self.f.root, name)
+    def __len__(self):
+        names = self.names()
+        return self[names[0]].shape[0] if names else 0
+    def row_nbytes(self):
+        """Bytes of a row summed up over all datasets."""
+        return sum([self[name].rowsize for name in self.names()])
+    def _create(self, name, array):
+        atom = tables.Atom.from_dtype(array.dtype)
+        shape = (0,) + array.shape[1:]
+        chunkshape = auto_chunkshape(shape, atom.itemsize, batch_rows=self.batch_rows) \
+                     if self.chunkshape == 'auto' else self.chunkshape
+        self.f.create_earray(self.f.root, name, atom, shape, filters=self.filters, chunkshape=chunkshape)
+    def append(self, **arrays):
+        """Append rows to all datasets at once, ex) `append(X=X, y=y)`."""
+        arrays = {name: np.asarray(a) for name, a in arrays.items()}
+        if len(set([len(a) for a in arrays.values()])) != 1:
+            raise ValueError('Number of rows differ: {}'.format({k: len(a) for k, a in arrays.items()}))
+        names = self.names()
+        if not names:
+            for name, a in arrays.items():
+                self._create(name, a)
+        elif set(names) != set(arrays):
+            raise ValueError('Datasets are {}, but given {}'.format(names, list(arrays)))
+        for name, a in arrays.items():
+            self[name].append(a)
+    def read_rows(self, index, names=None):
+        """Read rows of datasets by fancy index, returns dict of arrays."""
+        return {name: h5_read_rows(self[name], index) for name in (names or self.names())}
+    def close(self):
+        self.f.close()
+
+
+def _read_shard_rows(args):
+    filename, index, names = args
+    store = BigH5Store(filename)
+    store.open_for_read()
+    data = store.read_rows(index, names)
+    store.close()
+    return data
+
+
+class BigH5ShardedStore():
+    """BigH5Store spanning many files in a folder with global row index.
+
+    Appends roll over to a new shard file when a shard reaches `max_shard_bytes`,
+    and read_rows() can read from shards in parallel processes.
+
+    Arguments:
+        folder: Folder to store shard files `<prefix>_00000.h5`, `<prefix>_00001.h5`, ...
+        max_shard_bytes: Size limit of uncompressed data per shard.
+        prefix: Shard filename prefix.
+        store_params: Parameters for BigH5Store like `complib='zstd'`.
+    """
+    def __init__(self, folder, max_shard_bytes=4*1024**3, prefix='shard', **store_params):
+        self.folder = Path(folder)
+        self.max_shard_bytes = max_shard_bytes
+        self.prefix = prefix
+        self.store_params = store_params
+        self.stores, self.lengths = [], []
+    def shard_files(self):
+        return sorted(self.folder.glob('{}_*.h5'.format(self.prefix)))
+    def _new_shard(self):
+        if self.stores:
+            self.stores[-1].close()
+        store = BigH5Store(self.folder/'{}_{:05d}.h5'.format(self.prefix, len(self.stores)), **self.store_params)
+        store.open_for_write()
+        self.stores.append(store)
+        self.lengths.append(0)
+    def open_for_write(self):
+        """Open for writing, existing shards will be deleted."""
+        self.folder.mkdir(exist_ok=True, parents=True)
+        for f in self.shard_files():
+            f.unlink()
+        self.stores, self.lengths = [], []
+        self._new_shard()
+    def open_for_read(self):
+        self.stores = [BigH5Store(f, **self.store_params) for f in self.shard_files()]
+        for store in self.stores:
+            store.open_for_read()
+        self.lengths = [len(store) for store in self.stores]
+    def offsets(self):
+        """Global row index of the first row of each shard."""
+        return np.cumsum([0] + self.lengths[:-1]).astype(np.int64)
+    def __len__(self):
+        return int(np.sum(self.lengths))
+    def names(self):
+        return self.stores[0].names()
+    def append(self, **arrays):
+        """Append rows to all datasets, rolls over to a new shard at the size limit."""
+        arrays = {name: np.asarray(a) for name, a in arrays.items()}
+        n = len(next(iter(arrays.values())))
+        row_nbytes = sum([a[:1].nbytes for a in arrays.values()])
+        max_rows = max(1, self.max_shard_bytes // max(1, row_nbytes))
+        done = 0
+        while done < n:
+            room = max_rows - self.lengths[-1]
+            if room <= 0:
+                self._new_shard()
+                continue
+            take = min(room, n - done)
+            self.stores[-1].append(**{name: a[done:done+take] for name, a in arrays.items()})
+            self.lengths[-1] += take
+            done += take
+    def read_rows(self, index, names=None, num_workers=None):
+        """Read rows by global fancy index, returns dict of arrays.
+
+        Arguments:
+            num_workers: Read shards in parallel processes if 1 < num_workers.
+        """
+        index = _h5_normalize_index(index, len(self))
+        names = names or self.names()
+        shard_of = np.searchsorted(self.offsets(), index, side='right') - 1
+        order = np.argsort(shard_of, kind='stable')
+        shards = np.unique(shard_of)
+        tasks = [(self.stores[s].filename, index[shard_of == s] - self.offsets()[s], names) for s in shards]
+        if num_workers is not None and 1 < num_workers and 1 < len(tasks):
+            with Pool(num_workers) as p:
+                parts = p.map(_read_shard_rows, tasks)
+        else:
+            parts = [self.stores[s].read_rows(local, names) for s, (_, local, _) in zip(shards, tasks)]
+        inverse = np.argsort(order)
+        results = {}
+        for name in names:
+            if parts:
+                results[name] = np.concatenate([part[name] for part in parts])[inverse]
+            else:
+                node = self.stores[0][name]
+                results[name] = np.empty((0,) + tuple(node.shape[1:]), dtype=node.dtype)
+        return results
+    def close(self):
+        for store in self.stores:
+            if store.f.isopen:
+                store.close()
+
+
+def _h5_writer_process(q, result_q, filename, shape, params):
+    error, writer = None, None
+    try:
+        writer = BigH5Array(filename, shape, **params)
+        writer.open_for_write_expandable(buffer_rows='chunk')
+    except Exception as e:
+        error = e
+    while True:
+        rows = q.get()
+        if rows is None:
+            break
+        if error is not None:
+            continue # Keep draining the queue, or workers putting rows will block forever
+        try:
+            writer.append(rows)
+        except Exception as e:
+            error = e
+    try:
+        if error is None:
+            writer.flush()
+            result_q.put(writer.array_e.nrows)
+        if writer is not None and writer.f.isopen:
+            writer.close()
+    except Exception as e:
+        error = error or e
+    if error is not None:
+        result_q.put(error)
+
+
+class BigH5QueueWriter():
+    """Write expandable BigH5Array from multiple processes.
+
+    HDF5 is not safe for concurrent writers, then only one writer process owns the file,
+    and workers put rows into `queue` that is passed to them.
+    If writing fails, the writer keeps consuming the queue and discards rows,
+    so that workers don't block, and close() raises the error.
+
+    Example:
+        ```python
+        def worker(q, files):
+            for f in files:
+                q.put(extract_features(f))  # (n, 128) rows
+
+        with BigH5QueueWriter('features.h5', (0, 128)) as writer:
+            procs = [Process(target=worker, args=(writer.queue, files)) for files in file_groups]
+            [p.start() for p in procs]
+            [p.join() for p in procs]
+        ```
+
+    Arguments:
+        filename: HDF5 filename.
+        shape: Array shape, the first axis is not used.
+        max_queue: Max number of items in the queue, workers will wait if full.
+        params: Other BigH5Array parameters like `atom=..., complib='zstd'`.
+    """
+    def __init__(self, filename, shape, max_queue=64, **params):
+        self.queue = Queue(max_queue)
+        self._result_q = Queue()
+        self._process = Process(target=_h5_writer_process,
+                                args=(self.queue, self._result_q, filename, shape, params))
+        self._process.start()
+    def _check_alive(self):
+        if not self._process.is_alive():
+            raise RuntimeError('BigH5QueueWriter process has exited, exitcode={}'.format(self._process.exitcode))
+    def put(self, rows):
+        """Put rows, raises RuntimeError if the writer process is not running."""
+        rows = None if rows is None else np.asarray(rows)
+        while True:
+            self._check_alive()
+            try:
+                self.queue.put(rows, timeout=1)
+                return
+            except queue.Full:
+                pass
+    def close(self):
+        """Finish writing, returns number of rows written.
+        Raises the exception that stopped writing, if any."""
+        self.put(None)
+        while True:
+            alive = self._process.is_alive()
+            try:
+                result = self._result_q.get(timeout=1)
+                break
+            except queue.Empty:
+                if not alive:
+                    self._check_alive()
+        self._process.join()
+        if isinstance(result, Exception):
+            raise result
+        return result
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+
+
+def _h5_read_block(args):
+    filename, node, start, stop = args[:4]
+    f = _h5_open(filename, 'r')
+    try:
+        x = (_h5_default_node(f) if node is None else f.get_node(f.root, node))[start:stop]
+    finally:
+        f.close()
+    return x.reshape(len(x), -1)
+
+
+def _h5_block_moments(args):
+    x = _h5_read_block(args).astype(np.float64)
+    mean = x.mean(axis=0)
+    return len(x), mean, ((x - mean) ** 2).sum(axis=0), x.min(axis=0), x.max(axis=0)
+
+
+def _h5_merge_moments(a, b):
+    """Merge (count, mean, M2, min, max) of two blocks by Chan et al. parallel algorithm."""
+    n_a, mean_a, m2_a, min_a, max_a = a
+    n_b, mean_b, m2_b, min_b, max_b = b
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (n_b / n)
+    m2 = m2_a + m2_b + delta ** 2 * (n_a * n_b / n)
+    return n, mean, m2, np.minimum(min_a, min_b), np.maximum(max_a, max_b)
+
+
+def _h5_block_hist(args):
+    lo, hi, bins = args[4:]
+    x = _h5_read_block(args).astype(np.float64)
+    width = np.where(hi > lo, hi - lo, 1.0)
+    idx = np.clip(((x - lo) / width * bins).astype(np.int64), 0, bins - 1)
+    idx += np.arange(x.shape[1]) * bins
+    return np.bincount(idx.ravel(), minlength=x.shape[1] * bins).reshape(x.shape[1], bins)
+
+
+def _h5_map_blocks(fn, tasks, num_workers):
+    if num_workers is not None and 1 < num_workers:
+        with Pool(num_workers) as p:
+            return p.map(fn, tasks)
+    return [fn(task) for task in tasks]
+
+
+def big_h5_stats(filename, node=None, block_rows=65536, bins=None, quantiles=None, num_workers=None):
+    """Calculate per-feature statistics of BigH5Array file along rows, without loading all on memory.
+
+    Rows are read by blocks, block results are merged; mean/variance by Chan et al. parallel algorithm.
+    Histogram needs another pass, and quantiles are approximated from the histogram.
+
+    Arguments:
+        filename: HDF5 filename.
+        node: Node name, None will find BigH5Array's 'carray' or 'data'.
+        block_rows: Number of rows to read at once.
+        bins: Number of histogram bins between min and max, None will not calculate histogram.
+        quantiles: List of quantiles like [0.25, 0.5, 0.75], needs bins (default 1024).
+        num_workers: Process blocks in process pool if 1 < num_workers.
+
+    Returns:
+        Dict of 'count', 'mean', 'var' (unbiased), 'std', 'min' and 'max' shaped as a row,
+        'hist' (counts in (features, bins) shape) and 'bin_edges' (features, bins + 1) if bins is set,
+        'quantiles' (len(quantiles), *row shape) if quantiles is set.
+    """
+    with BigH5LazyArray(filename, node=node) as x:
+        n_rows, row_shape = len(x), x.shape[1:]
+    if n_rows == 0:
+        raise ValueError('No rows in {}'.format(filename))
+    tasks = [(filename, node, s, min(s + block_rows, n_rows)) for s in range(0, n_rows, block_rows)]
+    moments = _h5_map_blocks(_h5_block_moments, tasks, num_workers)
+    total = moments[0]
+    for m in moments[1:]:
+        total = _h5_merge_moments(total, m)
+    n, mean, m2, amin, amax = total
+    var = m2 / (n - 1) if 1 < n else np.zeros_like(m2)
+    stats = {'count': n, 'mean': mean.reshape(row_shape), 'var': var.reshape(row_shape),
+             'std': np.sqrt(var).reshape(row_shape), 'min': amin.reshape(row_shape), 'max': amax.reshape(row_shape)}
+    if quantiles is not None and bins is None:
+        bins = 1024
+    if bins is None:
+        return stats
+    tasks = [task + (amin, amax, bins) for task in tasks]
+    hist = np.sum(_h5_map_blocks(_h5_block_hist, tasks, num_workers), axis=0)
+    steps = np.linspace(0, 1, bins + 1)
+    edges = amin[:, np.newaxis] + (amax - amin)[:, np.newaxis] * steps
+    stats['hist'], stats['bin_edges'] = hist, edges
+    if quantiles is not None:
+        cdf = np.cumsum(hist, axis=1) / n
+        values = []
+        for q in quantiles:
+            idx = np.minimum((cdf < q).sum(axis=1), bins - 1)
+            features = np.arange(len(idx))
+            prev = np.where(0 < idx, cdf[features, np.maximum(idx - 1, 0)], 0.0)
+            in_bin = hist[features, idx] / n
+            frac = np.where(0 < in_bin, (q - prev) / np.where(0 < in_bin, in_bin, 1), 0.0)
+            values.append((edges[features, idx] + np.clip(frac, 0, 1) * (edges[:, 1] - edges[:, 0])).reshape(row_shape))
+        stats['quantiles'] = np.array(values)
+    return stats
+
+
+def big_h5_normalize(filename, dest_filename, mean=None, std=None, node=None, block_rows=65536,
+                     num_workers=None, **params):
+    """Write normalized copy `(x - mean) / std` of BigH5Array file block by block.
+
+    Arguments:
+        filename: Source HDF5 filename.
+        dest_filename: Destination filename, written as random access BigH5Array.
+        mean, std: Per-feature mean/std shaped as a row, None will calculate them by big_h5_stats().
+            Features with std = 0 will only be centered.
+        num_workers: Used for big_h5_stats().
+        params: Other BigH5Array parameters for the destination like `complib='zstd'`.
+
+    Returns:
+        Mean and std used for normalization.
+    """
+    if mean is None or std is None:
+        stats = big_h5_stats(filename, node=node, block_rows=block_rows, num_workers=num_workers)
+        mean = stats['mean'] if mean is None else mean
+        std = stats['std'] if std is None else std
+    std = np.where(std == 0, 1.0, std)
+    with BigH5LazyArray(filename, node=node) as src:
+        dest = BigH5Array(dest_filename, src.shape, **params)
+        dest.open_for_write()
+        for s in range(0, len(src), block_rows):
+            dest()[s:s+block_rows] = (src[s:s+block_rows] - mean) / std
+        dest.close()
+    return mean, std
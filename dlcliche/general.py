@@ -2,3 +2,21 @@ import os
 import sys
 from pathlib import Path
 import numpy as np
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Module placeholder that imports the module at the first attribute access.
+    Used to avoid importing heavy modules until they are actually used, ex) `pd = LazyModule('pandas')`.
+    """
+    def __init__(self, name):
+        super().__init__(name)
+    def _load(self):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return module
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+    def __dir__(self):
+        return dir(self._load())
@@ -6,21 +6,50 @@ import tqdm
 import math
 from PIL import Image
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+import json
 
 def resize_image(dest_folder, filename, shape):
     """Resize and save copy of image file to destination folder."""
     img = cv2.imread(str(filename))
+    if img is None:
+        raise ValueError(f'Failed to load {filename}.')
+    size = (img.shape[1], img.shape[0]) # original size
     if shape is not None:
         img = cv2.resize(img, shape)
     outfile = str(Path(dest_folder)/Path(filename).name)
-    cv2.imwrite(outfile, img)
-    return outfile, (img.shape[1], img.shape[0]) # original size
+    if not cv2.imwrite(outfile, img):
+        raise ValueError(f'Failed to write {outfile}.')
+    return outfile, size
 
 def _resize_image_worker(args):
-    return resize_image(args[0], args[1], args[2])
-
-def resize_image_files(dest_folder, source_files, shape=(224, 224), num_threads=8, skip_if_any_there=False):
-    """Make resized copy of listed images in parallel processes.
+    """Resize unless manifest record shows it's done, returns (outfile, size, error, new record)."""
+    dest_folder, filename, shape, record = args
+    try:
+        stat = Path(filename).stat()
+        key = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'shape': None if shape is None else list(shape)}
+        if record is not None and all(record[k] == v for k, v in key.items()) and Path(record['out']).exists():
+            return record['out'], tuple(record['orig']), None, None
+        outfile, size = resize_image(dest_folder, filename, shape)
+        return outfile, size, None, dict(src=str(filename), out=outfile, orig=list(size), **key)
+    except Exception as e:
+        return str(filename), None, f'{type(e).__name__}: {e}', None
+
+def _read_resize_manifest(manifest):
+    records = {}
+    if Path(manifest).exists():
+        with open(manifest) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue # Line broken by interruption
+                records[record['src']] = record
+    return records
+
+def resize_image_files(dest_folder, source_files, shape=(224, 224), num_threads=8, skip_if_any_there=False,
+                       resume=False, manifest=None, backend=None, chunksize=None, on_error='raise'):
+    """Make resized copy of listed images in parallel processes or threads.
 
     Arguments:
         dest_folder: Destination folder to make copies.
@@ -28,6 +57,15 @@ def resize_image_files(dest_folder, source_files, shape=(224, 224), num_threads=
         shape: (Width, Depth) shape of copies. None will NOT resize and makes dead copy.
         num_threads: Number of parallel workers.
         skip_if_any_there: If True, skip processing processing if any file have already been done.
+        resume: If True, skip files recorded in manifest as done, while the output exists
+            and size/mtime of the source and shape are the same. Newly done files are appended.
+        manifest: Manifest file that records done files, so that interrupted jobs can resume.
+            `<dest_folder>.resize_manifest.jsonl` next to dest_folder is used if None and resume is True.
+            Manifest is written only when resume is True or manifest is set, and is rewritten if not resume.
+        backend: 'process' or 'thread' (cv2 releases the GIL), 'thread' in notebook if None.
+        chunksize: Number of files sent to a worker at once, decided by number of files if None.
+        on_error: 'raise' raises RuntimeError after all files are processed if any failed,
+            'collect' logs errors and returns (source file, None) for failed files.
 
     Returns:
         List of image info (filename, original size) tuples, or None if skipped.
@@ -43,15 +81,33 @@ def resize_image_files(dest_folder, source_files, shape=(224, 224), num_threads=
             return None
     # Create destination folder if needed
     ensure_folder(dest_folder)
+    if manifest is None and resume:
+        manifest = Path(dest_folder).parent/(Path(dest_folder).name + '.resize_manifest.jsonl')
+    records = _read_resize_manifest(manifest) if resume else {}
+    args = [[dest_folder, f, shape, records.get(str(f))] for f in source_files]
+    backend = backend or ('thread' if running_in_notebook else 'process')
+    chunksize = chunksize or max(1, min(64, len(args) // (num_threads * 4)))
     # Do resize
-    if running_in_notebook:  # Workaround: not using pool on notebook
-        returns = []
-        for f in tqdm.tqdm(source_files, total=len(source_files)):
-            returns.append(resize_image(dest_folder, f, shape))
-    else:
-        with Pool(num_threads) as p:
-            args = [[dest_folder, f, shape] for f in source_files]
-            returns = list(tqdm.tqdm(p.imap(_resize_image_worker, args), total=len(args)))
+    returns, errors = [], []
+    mf = None if manifest is None else open(manifest, 'a' if resume else 'w', buffering=1)
+    try:
+        with (ThreadPool if backend == 'thread' else Pool)(num_threads) as p:
+            for outfile, size, error, record in tqdm.tqdm(p.imap(_resize_image_worker, args, chunksize=chunksize),
+                                                         total=len(args)):
+                returns.append((outfile, size))
+                if error is not None:
+                    errors.append((outfile, error))
+                if record is not None and mf is not None:
+                    mf.write(json.dumps(record) + '\n')
+    finally:
+        if mf is not None:
+            mf.close()
+    if 0 < len(errors):
+        if on_error == 'raise':
+            raise RuntimeError(f'Failed to resize {len(errors)} files, ex) {errors[0][0]}: {errors[0][1]}')
+        logger = get_logger()
+        for filename, error in errors:
+            logger.error(f'Failed to resize {filename}: {error}')
     return returns
 
 def _get_shape_worker(filename):
@@ -1,6 +1,8 @@
 import math
+import itertools
 import numpy as np
 import pandas as pd
+from pathlib import Path
 
 
 def roundup(x, n=10):
@@ -11,29 +13,207 @@ def roundup(x, n=10):
 def running_mean(x, N):
     """Calculate running/rolling mean or moving average.
     Thanks to https://stackoverflow.com/a/27681394/6528729
+    Calculated by rolling_mean() to keep precision on long series.
     """
-    cumsum = np.cumsum(np.insert(x, 0, 0)) 
-    return (cumsum[N:] - cumsum[:-N]) / float(N)
+    return rolling_mean(np.ravel(x), N)
 
 
-def np_describe(arr):
-    """Describe numpy array statistics.
+def _rolling_sums(X, window, block_rows):
+    """Yield (start, stop, K, sum(X - K), sum((X - K)^2)) of windows block by block.
+    Cumulative sums restart every block and data are shifted by block mean,
+    then precision doesn't degrade on long series unlike one big cumsum.
+    """
+    n_out = len(X) - window + 1
+    for start in range(0, n_out, block_rows):
+        stop = min(start + block_rows, n_out)
+        seg = np.asarray(X[start:stop + window - 1], dtype=np.float64)
+        K = seg.mean(axis=0)
+        d = seg - K
+        zero = np.zeros((1,) + d.shape[1:])
+        c1 = np.concatenate([zero, np.cumsum(d, axis=0)])
+        c2 = np.concatenate([zero, np.cumsum(d * d, axis=0)])
+        yield start, stop, K, c1[window:] - c1[:-window], c2[window:] - c2[:-window]
+
+
+def rolling_mean(X, window, block_rows=65536):
+    """Rolling mean of 1d array, or of each column of 2d array `X[n_samples, n_columns]`.
+
+    Returns:
+        Array of means, `len(X) - window + 1` rows.
+    """
+    X = np.asarray(X)
+    if len(X) < window:
+        return np.zeros((0,) + X.shape[1:])
+    means = np.empty((len(X) - window + 1,) + X.shape[1:])
+    for start, stop, K, s1, _ in _rolling_sums(X, window, max(block_rows, window)):
+        means[start:stop] = K + s1 / window
+    return means
+
+
+def rolling_var(X, window, ddof=1, block_rows=65536):
+    """Rolling variance of 1d array, or of each column of 2d array `X[n_samples, n_columns]`.
+
+    Returns:
+        Array of variances, `len(X) - window + 1` rows.
+    """
+    X = np.asarray(X)
+    if len(X) < window:
+        return np.zeros((0,) + X.shape[1:])
+    variances = np.empty((len(X) - window + 1,) + X.shape[1:])
+    for start, stop, _, s1, s2 in _rolling_sums(X, window, max(block_rows, window)):
+        variances[start:stop] = np.maximum(s2 - s1 * s1 / window, 0) / (window - ddof)
+    return variances
+
+
+def _describe_columns(percentiles):
+    return ['count', 'mean', 'std', 'min'] + ['{:g}%'.format(p * 100) for p in percentiles] + ['max']
+
+
+def _describe_rows(arr, axis):
+    """Reshape to 2d array whose columns are described for axis None/0/1."""
+    if axis is None:
+        return arr.reshape(-1, 1)
+    if axis == 0:
+        return arr.reshape(len(arr), -1)
+    if axis == 1:
+        return arr.reshape(len(arr), -1).T
+    raise ValueError('axis should be None, 0 or 1: {}'.format(axis))
+
+
+def np_describe(arr, axis=None, percentiles=(0.25, 0.5, 0.75), sample=None, random_state=None):
+    """Describe numpy array statistics, like pandas describe() without converting to pandas.
     Thanks to https://qiita.com/AnchorBlues/items/051dc69e81705b52adad
+
+    Percentiles are calculated by np.quantile, which uses np.partition instead of sorting.
+    NaNs are ignored as pandas does.
+
+    Arguments:
+        arr: Numpy array.
+        axis: None describes all values in a row, 0 describes each column of 2d array (or each element of rows),
+            1 describes each row.
+        percentiles: Percentiles to include.
+        sample: Number of rows (or values if axis is None) to sample for approximate percentiles.
+        random_state: Seed for sampling.
+
+    Returns:
+        DataFrame with count/mean/std/min/percentiles/max columns, one row (axis=None),
+        row per column (axis=0) or row per row (axis=1).
     """
-    return pd.DataFrame(pd.Series(arr.ravel()).describe()).transpose()
+    x = _describe_rows(np.asarray(arr), axis)
+    if np.issubdtype(x.dtype, np.floating) and np.isnan(x).any():
+        fn_count, fn_mean, fn_std, fn_min, fn_max, fn_q = (lambda a: np.sum(~np.isnan(a), axis=0)), \
+            np.nanmean, np.nanstd, np.nanmin, np.nanmax, np.nanquantile
+    else:
+        fn_count, fn_mean, fn_std, fn_min, fn_max, fn_q = (lambda a: np.full(a.shape[1], len(a))), \
+            np.mean, np.std, np.min, np.max, np.quantile
+    q_x = x
+    if sample is not None and sample < len(x):
+        q_x = x[np.random.RandomState(random_state).choice(len(x), sample, replace=False)]
+    values = [fn_count(x), fn_mean(x, axis=0), fn_std(x, axis=0, ddof=1), fn_min(x, axis=0)]
+    values += list(fn_q(q_x, percentiles, axis=0)) + [fn_max(x, axis=0)]
+    return pd.DataFrame(np.array(values, dtype=np.float64).T, columns=_describe_columns(percentiles))
+
+
+def np_describe_stream(source, axis=None, percentiles=(0.25, 0.5, 0.75), chunk_rows=65536, sketch_k=1024):
+    """Describe statistics of data streamed by row chunks, ex) BigH5Array file.
+    Percentiles are approximated by QuantileSketch.
 
+    Arguments:
+        source: Array like (np.ndarray, BigH5LazyArray, ...), BigH5Array filename or iterable of chunks.
+        axis: None describes all values, 0 describes each column, 1 describes each row exactly by np_describe().
+        percentiles: Percentiles to include.
+        chunk_rows: Number of rows to read at once.
+        sketch_k: Capacity of QuantileSketch compactor.
 
-def np_softmax(z):
+    Returns:
+        DataFrame same as np_describe().
+    """
+    _describe_rows(np.zeros((1, 1)), axis)
+    if axis == 1:
+        dfs = [np_describe(chunk, axis=1, percentiles=percentiles) for chunk in _row_chunks(source, chunk_rows)]
+        if len(dfs) == 0:
+            raise ValueError('No data to describe.')
+        return pd.concat(dfs, ignore_index=True)
+    stats = None
+    for chunk in _row_chunks(source, chunk_rows):
+        x = _describe_rows(chunk, axis)
+        if stats is None:
+            stats = OnlineMoments(x.shape[1], sketch_k=sketch_k)
+        stats.put_batch(x)
+    if stats is None:
+        raise ValueError('No data to describe.')
+    values = [np.full(len(stats.mean()), stats.count()), stats.mean(), stats.sigma(), stats.min]
+    values += list(stats.quantile(list(percentiles))) + [stats.max]
+    return pd.DataFrame(np.array(values, dtype=np.float64).T, columns=_describe_columns(percentiles))
+
+
+def _softmax_out(z, out, inplace):
+    if inplace:
+        return z
+    if out is None:
+        dtype = z.dtype if np.issubdtype(z.dtype, np.floating) else np.float64
+        return np.empty(z.shape, dtype=dtype)
+    return out
+
+
+def np_softmax(z, axis=-1, out=None, inplace=False):
     """Numpy version softmax.
     Thanjs to https://stackoverflow.com/a/39558290/6528729
+
+    Only one result-size buffer is used, and float32 input stays float32.
+
+    Arguments:
+        z: Input array of any dimension.
+        axis: Axis to calculate softmax along.
+        out: Array to store result, can be z itself.
+        inplace: Overwrite z with result if True, z has to be float array.
+    """
+    z = np.asarray(z)
+    out = _softmax_out(z, out, inplace)
+    s = np.max(z, axis=axis, keepdims=True)
+    np.subtract(z, s, out=out)
+    np.exp(out, out=out)
+    out /= np.sum(out, axis=axis, keepdims=True)
+    return out
+
+
+def np_logsumexp(z, axis=-1, keepdims=False):
+    """Numerically stable `log(sum(exp(z)))` along axis."""
+    z = np.asarray(z)
+    s = np.max(z, axis=axis, keepdims=True)
+    result = s + np.log(np.sum(np.exp(z - s), axis=axis, keepdims=True))
+    return result if keepdims else np.squeeze(result, axis=axis)
+
+
+def np_log_softmax(z, axis=-1, out=None, inplace=False):
+    """Numpy version log softmax, arguments are the same as np_softmax()."""
+    z = np.asarray(z)
+    out = _softmax_out(z, out, inplace)
+    s = np.max(z, axis=axis, keepdims=True)
+    np.subtract(z, s, out=out)
+    out -= np.log(np.sum(np.exp(out), axis=axis, keepdims=True))
+    return out
+
+
+def np_softmax_chunked(z, chunk_rows=65536, log=False, out=None):
+    """Softmax (or log softmax) along the last axis, processed by row blocks to cap peak memory.
+
+    Arguments:
+        z: Input array like, can be on disk like BigH5LazyArray or np.memmap.
+        chunk_rows: Number of rows to process at once.
+        log: Calculate log softmax if True.
+        out: Array like to write result to, can be on disk. None returns new np.ndarray.
     """
-    assert len(z.shape) == 2
-    s = np.max(z, axis=1)
-    s = s[:, np.newaxis] # necessary step to do broadcasting
-    e_x = np.exp(z - s)
-    div = np.sum(e_x, axis=1)
-    div = div[:, np.newaxis] # dito
-    return e_x / div
+    fn = np_log_softmax if log else np_softmax
+    for i in range(0, len(z), chunk_rows):
+        block = np.array(z[i:i+chunk_rows])
+        if not np.issubdtype(block.dtype, np.floating):
+            block = block.astype(np.float64)
+        fn(block, inplace=True)
+        if out is None:
+            out = np.empty((len(z),) + block.shape[1:], dtype=block.dtype)
+        out[i:i+len(block)] = block
+    return out
 
 
 def geometric_mean_preds(list_preds):
@@ -47,10 +227,12 @@ def geometric_mean_preds(list_preds):
     Returns:
         Geometric mean of input list of 2d numpy arrays.
     """
-    preds = list_preds[0].copy()
-    for next_preds in list_preds[1:]:
-        preds = np.multiply(preds, next_preds)
-    return np.power(preds, 1/len(list_preds))
+    # Sum of logs instead of product not to underflow with many models
+    with np.errstate(divide='ignore'):
+        log_preds = np.log(list_preds[0])
+        for next_preds in list_preds[1:]:
+            log_preds += np.log(next_preds)
+    return np.exp(log_preds / len(list_preds))
 
 
 def arithmetic_mean_preds(list_preds):
@@ -70,25 +252,213 @@ def arithmetic_mean_preds(list_preds):
     return preds / len(list_preds)
 
 
+def _row_chunks(preds, chunk_rows):
+    """Iterate rows of prediction results or any data by chunks.
+    preds can be array like (np.ndarray, BigH5LazyArray, ...), BigH5Array filename or iterable of chunks."""
+    if isinstance(preds, (str, Path)):
+        from .big_h5_array import BigH5LazyArray
+        with BigH5LazyArray(preds) as x:
+            yield from _row_chunks(x, chunk_rows)
+    elif isinstance(preds, list):
+        yield from _row_chunks(np.asarray(preds), chunk_rows)
+    elif hasattr(preds, 'shape') and hasattr(preds, '__getitem__'):
+        for i in range(0, len(preds), chunk_rows):
+            yield np.asarray(preds[i:i+chunk_rows])
+    else:
+        for chunk in preds:
+            yield np.asarray(chunk)
+
+
+class EnsembleAccumulator:
+    """Ensemble prediction results of models given one at a time.
+
+    Methods are:
+        - 'geometric': Weighted geometric mean, calculated in log space not to underflow.
+        - 'arithmetic': Weighted arithmetic mean.
+        - 'rank': Weighted mean of ranks for each class normalized to [0, 1], needs whole results of a model.
+
+    Only the accumulator of result size is kept, and models are read by `chunk_rows` rows.
+    For very large results, ensemble_preds() processes all models chunk by chunk instead.
+
+    Example:
+        ```python
+        ens = EnsembleAccumulator('geometric')
+        for file, weight in zip(pred_files, weights):
+            ens.put(file, weight=weight)  # BigH5Array file
+        preds = ens.result()
+        ```
+
+    Arguments:
+        method: One of 'geometric', 'arithmetic' or 'rank'.
+        eps: Probabilities are clipped by eps before log for 'geometric'.
+        chunk_rows: Number of rows to process at once.
+    """
+
+    def __init__(self, method='geometric', eps=1e-15, chunk_rows=65536):
+        if method not in ['geometric', 'arithmetic', 'rank']:
+            raise ValueError('Unknown method: {}'.format(method))
+        self.method = method
+        self.eps = eps
+        self.chunk_rows = chunk_rows
+        self.acc = None
+        self.total_weight = 0.0
+        self.n = 0
+
+    def _transform(self, chunk):
+        if self.method == 'geometric':
+            return np.log(np.clip(chunk, self.eps, None))
+        return chunk
+
+    def put(self, preds, weight=1.0):
+        """Put prediction results of a model.
+
+        Arguments:
+            preds: 2d array like, BigH5Array filename, or iterable of row chunks.
+            weight: Weight of this model.
+        """
+        chunks = _row_chunks(preds, self.chunk_rows)
+        if self.method == 'rank':
+            chunks = [_rank_columns(np.concatenate(list(chunks)))]
+        if self.acc is None:
+            self.acc = np.concatenate([weight * self._transform(chunk.astype(np.float64)) for chunk in chunks])
+        else:
+            offset = 0
+            for chunk in chunks:
+                self.acc[offset:offset+len(chunk)] += weight * self._transform(chunk.astype(np.float64))
+                offset += len(chunk)
+            if offset != len(self.acc):
+                raise ValueError('Number of rows {} != {}'.format(offset, len(self.acc)))
+        self.total_weight += weight
+        self.n += 1
+
+    def result(self):
+        """Ensembled result."""
+        if self.method == 'geometric':
+            return np.exp(self.acc / self.total_weight)
+        return self.acc / self.total_weight
+
+    def count(self):
+        return self.n
+
+
+def _rank_columns(preds):
+    ranks = np.empty(preds.shape)
+    for c in range(preds.shape[1]):
+        ranks[np.argsort(preds[:, c], kind='stable'), c] = np.arange(len(preds))
+    return ranks / max(1, len(preds) - 1)
+
+
+def ensemble_preds(list_preds, weights=None, method='geometric', eps=1e-15, chunk_rows=65536, out=None):
+    """Ensemble prediction results of many models chunk by chunk, within fixed memory.
+
+    All models are read by `chunk_rows` rows at the same time,
+    so memory usage is about `chunk_rows * n_classes * 2` float64 values.
+
+    Arguments:
+        list_preds: List of 2d array like, or BigH5Array filename.
+        weights: Weights for models, None will weight equally.
+        method: 'geometric' (calculated in log space) or 'arithmetic'.
+        eps: Probabilities are clipped by eps before log for 'geometric'.
+        chunk_rows: Number of rows to process at once.
+        out: Output array like to write to, or BigH5Array filename. None returns new np.ndarray.
+
+    Returns:
+        Ensembled result, or out.
+    """
+    if method not in ['geometric', 'arithmetic']:
+        raise ValueError('Unknown method: {}'.format(method))
+    weights = np.ones(len(list_preds)) if weights is None else np.asarray(weights, dtype=np.float64)
+    sources = [_row_chunks(preds, chunk_rows) for preds in list_preds]
+    results, offset, writer = [], 0, None
+    try:
+        for chunks in itertools.zip_longest(*sources):
+            rows = [None if chunk is None else len(chunk) for chunk in chunks]
+            if any(r != rows[0] for r in rows):
+                raise ValueError('Number of rows differs among models at row {}: {}'.format(offset, rows))
+            acc = np.zeros(chunks[0].shape)
+            for chunk, w in zip(chunks, weights):
+                acc += w * (np.log(np.clip(chunk, eps, None)) if method == 'geometric' else chunk)
+            acc /= weights.sum()
+            if method == 'geometric':
+                np.exp(acc, out=acc)
+            if out is None:
+                results.append(acc)
+            elif isinstance(out, (str, Path)):
+                if writer is None:
+                    from .big_h5_array import BigH5Array
+                    writer = BigH5Array(out, (0,) + acc.shape[1:])
+                    writer.open_for_write_expandable()
+                writer.append(acc)
+            else:
+                out[offset:offset+len(acc)] = acc
+            offset += len(acc)
+    finally:
+        if writer is not None:
+            writer.close()
+    if out is None:
+        return np.concatenate(results)
+    return out
+
+
 class OnlineStats:
     """Calculate mean/variance of a vector online
     Thanks to https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance
+
+    Arguments:
+        length: Length of a vector.
+        dtype: Accumulator dtype, float64 keeps precision even if input is float32.
     """
 
-    def __init__(self, length):
-        self.K = np.zeros((length))
-        self.Ex = np.zeros((length))
-        self.Ex2 = np.zeros((length))
+    def __init__(self, length, dtype=np.float64):
+        self.dtype = dtype
+        self.K = np.zeros((length), dtype=dtype)
+        self.Ex = np.zeros((length), dtype=dtype)
+        self.Ex2 = np.zeros((length), dtype=dtype)
         self.n = 0
 
     def put(self, x):
         if self.n == 0:
-            self.K = x
+            self.K = np.array(x, dtype=self.dtype)
         self.n += 1
         d = x - self.K
         self.Ex += d
         self.Ex2 += d * d
 
+    def put_batch(self, X, block_rows=4096):
+        """Put 2d array of vectors `X[n_samples, length]` at once.
+        X is processed by `block_rows` rows to limit temporary memory."""
+        X = np.asarray(X)
+        if len(X) == 0:
+            return
+        if self.n == 0:
+            self.K = np.array(X[0], dtype=self.dtype)
+        for i in range(0, len(X), block_rows):
+            d = X[i:i+block_rows] - self.K
+            self.Ex += d.sum(axis=0)
+            self.Ex2 += np.einsum('ij,ij->j', d, d)
+        self.n += len(X)
+
+    def merge(self, other):
+        """Merge statistics of other OnlineStats, by Chan et al. parallel algorithm.
+        Useful for combining stats calculated in separate processes or shards."""
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.K, self.Ex, self.Ex2, self.n = [np.array(v, dtype=self.dtype) for v in
+                                                 (other.K, other.Ex, other.Ex2)] + [other.n]
+            return self
+        n = self.n + other.n
+        mean_a, mean_b = self.mean(), other.mean()
+        m2_a = self.Ex2 - self.Ex * self.Ex / self.n
+        m2_b = other.Ex2 - other.Ex * other.Ex / other.n
+        delta = mean_b - mean_a
+        # Shift by new mean, then Ex = 0 and Ex2 = M2
+        self.K = np.array(mean_a + delta * (other.n / n), dtype=self.dtype)
+        self.Ex = np.zeros_like(self.K)
+        self.Ex2 = np.array(m2_a + m2_b + delta * delta * (self.n * other.n / n), dtype=self.dtype)
+        self.n = n
+        return self
+
     def undo(self, x):
         self.n -= 1
         d = x - self.K
@@ -119,3 +489,271 @@ class OnlineStats:
         self.Ex = mean_values
         self.Ex2 = 0.0
         self.n = 1
+
+
+class OnlineMoments:
+    """Calculate mean/variance/skewness/kurtosis and min/max of a vector online,
+    and approximate quantiles if `sketch_k` is set.
+    Thanks to https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Higher-order_statistics
+
+    Arguments:
+        length: Length of a vector.
+        sketch_k: Capacity of QuantileSketch compactor, None will not calculate quantiles.
+        random_state: Seed for QuantileSketch.
+    """
+
+    def __init__(self, length, sketch_k=None, random_state=None):
+        self.n = 0
+        self.M1, self.M2, self.M3, self.M4 = [np.zeros((length)) for _ in range(4)]
+        self.min = np.full((length), np.inf)
+        self.max = np.full((length), -np.inf)
+        self.sketch = None if sketch_k is None else QuantileSketch(length, k=sketch_k, random_state=random_state)
+
+    def put(self, x):
+        self.put_batch(np.asarray(x)[np.newaxis])
+
+    def put_batch(self, X):
+        """Put 2d array of vectors `X[n_samples, length]` at once."""
+        X = np.asarray(X)
+        if len(X) == 0:
+            return
+        mean = X.mean(axis=0, dtype=np.float64)
+        d = X - mean
+        d2 = d * d
+        self._merge(len(X), mean, d2.sum(axis=0), (d2 * d).sum(axis=0), (d2 * d2).sum(axis=0))
+        self.min = np.minimum(self.min, X.min(axis=0))
+        self.max = np.maximum(self.max, X.max(axis=0))
+        if self.sketch is not None:
+            self.sketch.put_batch(X)
+
+    def _merge(self, n_b, M1_b, M2_b, M3_b, M4_b):
+        # Thanks to Pebay (2008) formulas for arbitrary-order moments.
+        n_a, M1_a, M2_a, M3_a, M4_a = self.n, self.M1, self.M2, self.M3, self.M4
+        n = n_a + n_b
+        delta = M1_b - M1_a
+        d_n = delta / n
+        self.M1 = M1_a + d_n * n_b
+        self.M2 = M2_a + M2_b + delta * d_n * n_a * n_b
+        self.M3 = M3_a + M3_b + delta * d_n * d_n * n_a * n_b * (n_a - n_b) \
+                  + 3 * d_n * (n_a * M2_b - n_b * M2_a)
+        self.M4 = M4_a + M4_b + delta * d_n ** 3 * n_a * n_b * (n_a * n_a - n_a * n_b + n_b * n_b) \
+                  + 6 * d_n * d_n * (n_a * n_a * M2_b + n_b * n_b * M2_a) \
+                  + 4 * d_n * (n_a * M3_b - n_b * M3_a)
+        self.n = n
+
+    def merge(self, other):
+        """Merge statistics of other OnlineMoments."""
+        if other.n == 0:
+            return self
+        self._merge(other.n, other.M1, other.M2, other.M3, other.M4)
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        if self.sketch is not None and other.sketch is not None:
+            self.sketch.merge(other.sketch)
+        return self
+
+    def mean(self):
+        return self.M1.copy()
+
+    def variance(self):
+        """Unbiased variance."""
+        if self.n < 2:
+            return np.zeros_like(self.M2)
+        return self.M2 / (self.n - 1)
+
+    def sigma(self):
+        return np.sqrt(self.variance())
+
+    def skewness(self):
+        """Skewness, same as `scipy.stats.skew(X)`."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(0 < self.M2, np.sqrt(self.n) * self.M3 / np.power(self.M2, 1.5), 0.0)
+
+    def kurtosis(self):
+        """Excess kurtosis, same as `scipy.stats.kurtosis(X)`."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(0 < self.M2, self.n * self.M4 / (self.M2 * self.M2) - 3.0, 0.0)
+
+    def quantile(self, q):
+        """Approximate quantile(s) by QuantileSketch, available if `sketch_k` is set."""
+        if self.sketch is None:
+            raise ValueError('Set sketch_k to calculate quantiles.')
+        return self.sketch.quantile(q)
+
+    def count(self):
+        return self.n
+
+
+class QuantileSketch:
+    """Mergeable approximate quantile sketch of a vector stream, KLL-like randomized compactors.
+
+    Each level keeps up to `k` items per element of vector, level h items have weight 2^h.
+    A full level is sorted and every other item goes up to the next level,
+    then memory stays around `k * log2(n / k)` items per element.
+    All elements get the same number of samples, so levels are kept as (items, length) arrays.
+    Thanks to https://arxiv.org/abs/1603.05346
+
+    Arguments:
+        length: Length of a vector.
+        k: Compactor capacity, larger is more accurate.
+        random_state: Seed for compaction.
+    """
+
+    def __init__(self, length, k=200, random_state=None):
+        self.length = length
+        self.k = k
+        self.levels = [np.empty((0, length))]
+        self.n = 0
+        self.rng = np.random.RandomState(random_state)
+
+    def put(self, x):
+        self.put_batch(np.asarray(x)[np.newaxis])
+
+    def put_batch(self, X):
+        """Put 2d array of vectors `X[n_samples, length]` at once."""
+        X = np.asarray(X, dtype=np.float64).reshape(-1, self.length)
+        self.levels[0] = np.concatenate([self.levels[0], X])
+        self.n += len(X)
+        self._compress()
+
+    def merge(self, other):
+        """Merge other QuantileSketch."""
+        for h, items in enumerate(other.levels):
+            if len(self.levels) <= h:
+                self.levels.append(np.empty((0, self.length)))
+            self.levels[h] = np.concatenate([self.levels[h], items])
+        self.n += other.n
+        self._compress()
+        return self
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            items = self.levels[h]
+            if self.k <= len(items):
+                items = np.sort(items, axis=0)
+                keep = items[len(items) - len(items) % 2:]
+                promoted = items[self.rng.randint(2):len(items) - len(items) % 2:2]
+                self.levels[h] = keep
+                if len(self.levels) <= h + 1:
+                    self.levels.append(np.empty((0, self.length)))
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+            h += 1
+
+    def quantile(self, q):
+        """Approximate quantile(s) for each element, q is a value or list in [0, 1]."""
+        if self.n == 0:
+            raise ValueError('No samples.')
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2.0 ** h) for h, items in enumerate(self.levels)])
+        order = np.argsort(values, axis=0)
+        values = np.take_along_axis(values, order, axis=0)
+        cum_weights = np.cumsum(weights[order], axis=0)
+        qs = np.atleast_1d(q)
+        idx = np.array([np.minimum((cum_weights < _q * cum_weights[-1]).sum(axis=0), len(values) - 1)
+                        for _q in qs])
+        results = values[idx, np.arange(self.length)]
+        return results[0] if np.ndim(q) == 0 else results
+
+    def count(self):
+        return self.n
+
+
+class WindowedStats:
+    """Calculate mean/variance of last `window` vectors online, with internal ring buffer.
+
+    Updated by Welford's algorithm, and recalculated from the buffer every time it wraps around
+    so that rounding errors don't accumulate.
+
+    Arguments:
+        length: Length of a vector.
+        window: Number of latest vectors to calculate.
+    """
+
+    def __init__(self, length, window):
+        self.window = window
+        self.buf = np.zeros((window, length))
+        self.pos = 0
+        self.n = 0
+        self.M1 = np.zeros((length))
+        self.M2 = np.zeros((length))
+
+    def put(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        if self.n < self.window:
+            self.n += 1
+            delta = x - self.M1
+            self.M1 += delta / self.n
+            self.M2 += delta * (x - self.M1)
+        else:
+            old = self.buf[self.pos]
+            new_M1 = self.M1 + (x - old) / self.n
+            self.M2 += (x - old) * (x - new_M1 + old - self.M1)
+            self.M1 = new_M1
+        self.buf[self.pos] = x
+        self.pos = (self.pos + 1) % self.window
+        if self.pos == 0:
+            self.M1 = self.buf.mean(axis=0)
+            self.M2 = ((self.buf - self.M1) ** 2).sum(axis=0)
+
+    def mean(self):
+        return self.M1.copy()
+
+    def variance(self):
+        if self.n < 2:
+            return np.zeros_like(self.M1)
+        return np.maximum(self.M2, 0) / (self.n - 1)
+
+    def sigma(self):
+        return np.sqrt(self.variance())
+
+    def count(self):
+        return self.n
+
+
+class EWMStats:
+    """Calculate exponentially-weighted mean/variance of a vector online.
+    Same as pandas `ewm(alpha=alpha, adjust=False)` `.mean()` and `.var(bias=True)`.
+    Thanks to https://fanf2.user.srcf.net/hermes/doc/antiforgery/stats.pdf
+
+    Arguments:
+        length: Length of a vector.
+        alpha: Smoothing factor 0 < alpha <= 1.
+        span: Set alpha as `2 / (span + 1)` instead.
+    """
+
+    def __init__(self, length, alpha=None, span=None):
+        if (alpha is None) == (span is None):
+            raise ValueError('Set one of alpha or span.')
+        self.alpha = alpha if alpha is not None else 2.0 / (span + 1)
+        self.M1 = np.zeros((length))
+        self.var = np.zeros((length))
+        self.n = 0
+
+    def put(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        if self.n == 0:
+            self.M1 = x.copy()
+        else:
+            diff = x - self.M1
+            incr = self.alpha * diff
+            self.M1 = self.M1 + incr
+            self.var = (1 - self.alpha) * (self.var + diff * incr)
+        self.n += 1
+
+    def put_batch(self, X):
+        """Put 2d array of vectors `X[n_samples, length]` in order."""
+        for x in X:
+            self.put(x)
+
+    def mean(self):
+        return self.M1.copy()
+
+    def variance(self):
+        return self.var.copy()
+
+    def sigma(self):
+        return np.sqrt(self.var)
+
+    def count(self):
+        return self.n
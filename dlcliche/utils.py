@@ -1,14 +1,34 @@
 from .general import *
 from .ignore_warnings import *
 
-import IPython
-import matplotlib
-import matplotlib.pyplot as plt
-import pandas as pd
+# Heavy modules are imported at the first use
+IPython = LazyModule('IPython')
+matplotlib = LazyModule('matplotlib')
+plt = LazyModule('matplotlib.pyplot')
+pd = LazyModule('pandas')
 from easydict import EasyDict
-from tqdm import tqdm_notebook
 import shutil
 import datetime
+import re
+from multiprocessing import Pool
+
+def tqdm_notebook(*args, **kwargs):
+    from tqdm import tqdm_notebook as _tqdm_notebook
+    return _tqdm_notebook(*args, **kwargs)
+
+def _lazy_function(module, name):
+    """Function that imports `module.name` at the first call, works with star import."""
+    def fn(*args, **kwargs):
+        return getattr(importlib.import_module(module), name)(*args, **kwargs)
+    fn.__name__ = fn.__qualname__ = name
+    fn.__doc__ = 'Lazily imported {}.{}.'.format(module, name)
+    return fn
+
+f1_score = _lazy_function('sklearn.metrics', 'f1_score')
+precision_score = _lazy_function('sklearn.metrics', 'precision_score')
+recall_score = _lazy_function('sklearn.metrics', 'recall_score')
+accuracy_score = _lazy_function('sklearn.metrics', 'accuracy_score')
+confusion_matrix = _lazy_function('sklearn.metrics', 'confusion_matrix')
 
 ## File utilities
 
@@ -240,7 +260,9 @@ def df_to_csv_excel_friendly(df, filename, **args):
 
 def df_merge_update(df_list_or_org_file, opt_joining_file=None):
     """Merge data frames while update duplicated index with following (joining) row.
-    
+
+    All frames are concatenated at once, and the last row is kept for each index.
+
     Usages:
         - df_merge_update([df1, df2, ...]) merges dfs in list.
         - df_merge_update(df1, df2) merges df1 and df2.
@@ -248,13 +270,75 @@ def df_merge_update(df_list_or_org_file, opt_joining_file=None):
     if opt_joining_file is not None:
         df_list = [df_list_or_org_file, opt_joining_file]
     else:
-        df_list = df_list_or_org_file
+        df_list = list(df_list_or_org_file)
+
+    if len(df_list) == 1:
+        return df_list[0]
+    merged = pd.concat(df_list)
+    return merged[~merged.index.duplicated(keep='last')].sort_index(kind='mergesort')
+
+def _df_read_file(filename, index_col=None, **kwargs):
+    """Read data frame by file suffix: .pkl, .h5 or CSV/Excel for others.
+
+    Index of CSV/Excel files is set to index_col, or the 1st column if index_col is None.
+    Pickle/HDF5 files keep their index unless index_col is one of the columns.
+    """
+    suffix = Path(filename).suffix.lower()
+    if suffix in ['.pkl', '.pickle']:
+        df = pd.read_pickle(filename)
+    elif suffix in ['.h5', '.hdf', '.hdf5']:
+        df = pd.read_hdf(filename)
+    else:
+        df = df_load_excel_like(filename, **kwargs)
+        return df.set_index(df.columns[0] if index_col is None else index_col)
+    return df.set_index(index_col) if index_col is not None and index_col in df.columns else df
+
+def _df_write_file(df, filename):
+    """Write data frame by file suffix, through temporary file to replace atomically."""
+    filename = Path(filename)
+    tmp_file = filename.with_name('.tmp_' + filename.name)
+    suffix = filename.suffix.lower()
+    if suffix in ['.pkl', '.pickle']:
+        df.to_pickle(tmp_file)
+    elif suffix in ['.h5', '.hdf', '.hdf5']:
+        df.to_hdf(tmp_file, key='df', mode='w')
+    elif suffix == '.xlsx':
+        df.to_excel(tmp_file)
+    elif suffix == '.xls':
+        raise ValueError(f'Cannot write .xls file, use .xlsx instead: {filename}')
+    else:
+        df.to_csv(tmp_file)
+    tmp_file.replace(filename)
+
+def df_merge_update_files(base_file, delta_files, index_col=None, output_file=None, batch_files=32, **kwargs):
+    """Apply delta files to a base file on disk by df_merge_update().
+
+    Deltas are read and merged by every `batch_files` files, so that memory usage stays
+    around the size of base plus a batch. Result is written to `output_file`,
+    or replaces `base_file`. Base file will be created if it doesn't exist.
+
+    Arguments:
+        base_file: Base data frame file, .pkl/.h5 keeps dtypes, or CSV/.xlsx.
+        delta_files: Delta files in the order of application.
+        index_col: Index column of CSV/Excel files, the 1st column if None.
+            Pickle/HDF5 files keep their index unless it is one of their columns.
+        output_file: Output file, or None to update base_file.
+        batch_files: Number of delta files to merge at once.
+        kwargs: Passed to df_load_excel_like() for reading CSV/Excel files.
 
-    master = df_list[0]
-    for df in df_list[1:]:
-        tmp_df = pd.concat([master, df])
-        master = tmp_df[~tmp_df.index.duplicated(keep='last')].sort_index()
-    return master
+    Returns:
+        Merged data frame.
+    """
+    base = None
+    if Path(base_file).exists():
+        base = _df_read_file(base_file, index_col=index_col, **kwargs)
+    delta_files = list(delta_files)
+    for i in range(0, len(delta_files), batch_files):
+        dfs = [_df_read_file(f, index_col=index_col, **kwargs) for f in delta_files[i:i+batch_files]]
+        base = df_merge_update(dfs if base is None else [base] + dfs)
+    if base is not None:
+        _df_write_file(base, output_file or base_file)
+    return base
 
 def df_select_by_keyword(source_df, keyword, search_columns=None, as_mask=False):
     """Select data frame rows by a search keyword.
@@ -271,33 +355,133 @@ def df_select_by_keyword(source_df, keyword, search_columns=None, as_mask=False)
         return mask
     return source_df.loc[mask]
 
-def df_select_by_keywords(source_df, keys_cols, and_or='or', as_mask=False):
+class KeywordIndex:
+    """Normalized text of DataFrame columns for repeated keyword searches.
+
+    Texts of search columns are normalized once, then keywords are combined into one
+    pattern and searched by one scan per column instead of one scan per keyword and column.
+    Cells other than str never match.
+
+    Arguments:
+        df: DataFrame to search.
+        case: Case sensitive if True, or texts are stored in lower case.
+    """
+    def __init__(self, df, case=True):
+        self.df = df
+        self.case = case
+        self.columns = {}
+
+    def _column(self, c):
+        if c not in self.columns:
+            s = self.df[c]
+            if s.dtype == object or isinstance(s.dtype, (pd.CategoricalDtype, pd.StringDtype)):
+                s = s.astype(object)
+                text = s.where(s.str.len().notna(), '')
+            else:
+                text = pd.Series('', index=s.index)
+            self.columns[c] = text if self.case else text.str.lower()
+        return self.columns[c]
+
+    def _pattern(self, keywords, regex):
+        if not regex:
+            keywords = [re.escape(k if self.case else k.lower()) for k in keywords]
+        return re.compile('|'.join(['(?:{})'.format(k) for k in keywords]), 0 if self.case else re.IGNORECASE)
+
+    def contains(self, keywords, columns=None, regex=True):
+        """Mask of rows where any of keywords is found in any of columns, by one scan per column."""
+        if isinstance(keywords, str):
+            keywords = [keywords]
+        pattern = self._pattern(keywords, regex)
+        columns = self.df.columns if columns is None else columns
+        mask = np.zeros(len(self.df), dtype=bool)
+        for c in columns:
+            mask |= self._column(c).str.contains(pattern, na=False).values
+        return mask
+
+    def select(self, keys_cols, and_or='or', regex=True):
+        """Mask of rows by multiple keywords, see df_select_by_keywords()."""
+        if and_or == 'or':
+            # Keywords for the same columns are searched at once
+            groups = {}
+            for keyword, columns in keys_cols.items():
+                key = None if columns is None else tuple(columns)
+                groups.setdefault(key, []).append(keyword)
+            masks = [self.contains(keywords, columns, regex) for columns, keywords in groups.items()]
+            return np.column_stack(masks).any(axis=1)
+        masks = [self.contains(keyword, columns, regex) for keyword, columns in keys_cols.items()]
+        return np.column_stack(masks).all(axis=1)
+
+def df_keyword_index(df, case=True, cache=False):
+    """Get KeywordIndex of DataFrame, cached in the df object if cache is True.
+
+    Cache is not inherited by derived frames, and is rebuilt if shape of df changes.
+    Cached index is not updated when values of df are modified, use cache=False then.
+    """
+    if not cache:
+        return KeywordIndex(df, case=case)
+    # Not in df.attrs, which is copied to derived frames
+    owner, shape, indexes = getattr(df, '_keyword_index_cache', (None, None, {}))
+    if owner != id(df) or shape != df.shape:
+        indexes = {}
+        object.__setattr__(df, '_keyword_index_cache', (id(df), df.shape, indexes))
+    if case not in indexes:
+        indexes[case] = KeywordIndex(df, case=case)
+    return indexes[case]
+
+def df_select_by_keywords(source_df, keys_cols, and_or='or', as_mask=False, regex=True, case=True, cache=False):
     """Multi keyword version of df_select_by_keyword.
 
+    Keywords are searched with KeywordIndex; all keywords for the same columns are combined
+    into one pattern for 'or', and each keyword is searched separately for 'and'.
+
     Arguments:
         key_cols: dict defined as `{'keyword1': [search columns] or None, ...}`
+        and_or: 'or' selects rows having any of keywords, 'and' selects rows having all.
+        regex: Keywords are regular expressions if True, or literal strings.
+        case: Case sensitive if True.
+        cache: Keep normalized texts with source_df for repeated queries, see df_keyword_index().
     """
-    masks = []
-    for keyword in keys_cols:
-        columns = keys_cols[keyword]
-        mask = df_select_by_keyword(source_df, keyword, search_columns=columns, as_mask=True)
-        masks.append(mask)
-    mask = np.column_stack(masks).any(axis=1) if and_or == 'or' else \
-           np.column_stack(masks).all(axis=1)
+    mask = df_keyword_index(source_df, case=case, cache=cache).select(keys_cols, and_or=and_or, regex=regex)
     if as_mask:
         return mask
     return source_df.loc[mask]
 
-def df_str_replace(df, from_strs, to_str):
-    """Apply str.replace to entire DataFrame inplace."""
-    for i, row in df.iterrows():
-        df.ix[i] = df.ix[i].str.replace(from_strs, to_str)
+def _str_replace_column(series, from_strs, to_str, regex):
+    replaced = series.str.replace(from_strs, to_str, regex=regex)
+    # Non-str cells (numbers, NaN, ...) are kept as is
+    return replaced.where(replaced.notna(), series)
+
+def _df_str_replace_columns(args):
+    df, from_strs, to_str, regex = args
+    return {c: _str_replace_column(df[c], from_strs, to_str, regex) for c in df.columns}
+
+def df_str_replace(df, from_strs, to_str, regex=True, num_workers=None):
+    """Apply str.replace to entire DataFrame inplace.
+
+    Arguments:
+        from_strs: Pattern to replace, regular expression if regex is True.
+        to_str: Replacement string.
+        regex: Treat from_strs as regular expression or literal string.
+        num_workers: Process groups of columns in parallel processes if 1 < num_workers.
+    """
+    columns = [c for c in df.columns if df[c].dtype == object]
+    if num_workers is None or num_workers <= 1 or len(columns) <= 1:
+        for c in columns:
+            df[c] = _str_replace_column(df[c], from_strs, to_str, regex)
+        return
+    groups = [columns[i::num_workers] for i in range(min(num_workers, len(columns)))]
+    with Pool(len(groups)) as p:
+        results = p.map(_df_str_replace_columns, [(df[g], from_strs, to_str, regex) for g in groups])
+    for result in results:
+        for c in result:
+            df[c] = result[c]
 
 def df_cell_str_replace(df, from_str, to_str):
     """Replace cell string with new string if entire string matches."""
-    for i, row in df.iterrows():
-        for c in df.columns:
-            df.at[i, c] = to_str if str(df.at[i, c]) == from_str else df.at[i, c]
+    for c in df.columns:
+        mask = (df[c].astype(str) == from_str).values
+        if mask.any():
+            df[c] = df[c].where(~mask, to_str)
 
 _EXCEL_LIKE = ['.csv', '.xls', '.xlsx', '.xlsm']
 def is_excel_file(filename):
@@ -321,29 +505,145 @@ def pd_read_csv_as_str(filename, **args):
     """pd.read_csv() wrapper to preserve data type = str"""
     return pd.read_csv(filename, dtype=object, **args)
 
-def df_load_excel_like(filename, preserve_dtype=True, **args):
-    """Load Excel like files. (csv, xlsx, ...)"""
+def df_as_str_dtype(df, str_dtype):
+    """Convert object columns to `str_dtype` such as 'category' or 'string' to save memory.
+    Dict of data frames, as returned by pd.read_excel(sheet_name=None), is also accepted."""
+    if isinstance(df, dict):
+        return {k: df_as_str_dtype(v, str_dtype) for k, v in df.items()}
+    if str_dtype is None:
+        return df
+    columns = [c for c in df.columns if df[c].dtype == object]
+    return df.astype({c: str_dtype for c in columns}) if columns else df
+
+def _df_read_excel_like(filename, preserve_dtype, str_dtype, **args):
     if is_csv_file(filename):
         if preserve_dtype:
-            return pd_read_csv_as_str(filename, **args)
-        return pd.read_csv(filename, **args)
+            # CSV parser directly makes str_dtype columns
+            return pd.read_csv(filename, dtype=str_dtype or object, **args)
+        return df_as_str_dtype(pd.read_csv(filename, **args), str_dtype)
     if preserve_dtype:
-        return pd_read_excel_keep_dtype(filename, **args)
-    return pd.read_excel(filename, **args)
+        return df_as_str_dtype(pd_read_excel_keep_dtype(filename, **args), str_dtype)
+    return df_as_str_dtype(pd.read_excel(filename, **args), str_dtype)
+
+def _df_iter_excel_like(filename, preserve_dtype, str_dtype, chunksize, **args):
+    if is_csv_file(filename):
+        dtype = (str_dtype or object) if preserve_dtype else None
+        with pd.read_csv(filename, dtype=dtype, chunksize=chunksize, **args) as reader:
+            for df in reader:
+                yield df if preserve_dtype else df_as_str_dtype(df, str_dtype)
+        return
+    # Excel files can only be parsed at once
+    df = _df_read_excel_like(filename, preserve_dtype, str_dtype, **args)
+    for i in range(0, len(df), chunksize):
+        yield df.iloc[i:i+chunksize]
+
+def df_load_cache_file(filename, cache_folder=None, **options):
+    """Cache file name of a loaded data frame, keyed by file path, load options, mtime and size.
+
+    Cache files are placed in `cache_folder`, or `.df_cache` folder next to the file,
+    named `<file name>.<path hash>.<options hash>.<mtime and size hash>.pkl`.
+    """
+    import hashlib
+    def _hash(key):
+        return hashlib.md5(repr(key).encode()).hexdigest()[:16]
+    filename = Path(filename).resolve()
+    stat = filename.stat()
+    folder = Path(cache_folder) if cache_folder else filename.parent/'.df_cache'
+    return folder/(f'{filename.name}.{_hash(str(filename))}.{_hash(sorted(options.items()))}'
+                   f'.{_hash((stat.st_mtime_ns, stat.st_size))}.pkl')
+
+def df_load_excel_like(filename, preserve_dtype=True, str_dtype=None, usecols=None, chunksize=None,
+                       cache=False, cache_folder=None, **args):
+    """Load Excel like files. (csv, xlsx, ...)
+
+    Arguments:
+        preserve_dtype: Read values as stored in file, as str (object) for CSV.
+        str_dtype: Convert object columns to 'category' or 'string' if set, to save memory.
+        usecols: Columns to read, passed to the parser so that other columns are skipped.
+        chunksize: Returns iterator of data frames having chunksize rows if set.
+            CSV files are parsed chunk by chunk, Excel files are parsed at once.
+            Note that categories of 'category' columns can differ among chunks.
+        cache: Keep parsed result as pickle file and load it next time
+            while the file is not modified, see df_load_cache_file(). Not used with chunksize.
+        cache_folder: Folder for cache files.
+    """
+    if usecols is not None:
+        args['usecols'] = usecols
+    if chunksize is not None:
+        return _df_iter_excel_like(filename, preserve_dtype, str_dtype, chunksize, **args)
+    if not cache:
+        return _df_read_excel_like(filename, preserve_dtype, str_dtype, **args)
+
+    cache_file = df_load_cache_file(filename, cache_folder=cache_folder,
+                                    preserve_dtype=preserve_dtype, str_dtype=str_dtype, **args)
+    if cache_file.exists():
+        return pd.read_pickle(cache_file)
+    df = _df_read_excel_like(filename, preserve_dtype, str_dtype, **args)
+    # Remove caches of older contents of the same file, then write through temporary file
+    ensure_folder(cache_file.parent)
+    name, path_hash, _, stat_hash, _ = cache_file.name.rsplit('.', 4)
+    for old_file in cache_file.parent.glob(f'{name}.{path_hash}.*.*.pkl'):
+        if old_file.name.rsplit('.', 2)[1] != stat_hash:
+            ensure_delete(old_file)
+    tmp_file = cache_file.with_name('.tmp_' + cache_file.name)
+    pd.to_pickle(df, tmp_file)
+    tmp_file.replace(cache_file)
+    return df
 
 import codecs
-def df_read_sjis_csv(filename, **args):
+_JA_ENCODINGS = ['utf-8-sig', 'utf-8', 'cp932', 'euc_jp']
+def detect_text_encoding(filename, candidates=_JA_ENCODINGS, sample_bytes=1024*1024):
+    """Detect text file encoding by decoding first sample_bytes with candidate encodings.
+
+    Returns:
+        First candidate that decodes the sample without error, or None.
+    """
+    with open(filename, 'rb') as f:
+        sample = f.read(sample_bytes)
+    for encoding in candidates:
+        try:
+            # Incremental decoder accepts a multibyte character cut at the end of sample
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=len(sample) < sample_bytes)
+        except UnicodeDecodeError:
+            continue
+        # utf-8-sig also decodes files without BOM
+        if encoding == 'utf-8-sig' and not sample.startswith(codecs.BOM_UTF8):
+            continue
+        return encoding
+    return None
+
+def df_read_sjis_csv(filename, encoding='cp932', encoding_errors='replace', chunksize=None, **args):
     """Read shift jis Japanese csv file.
-    Thanks to https://qiita.com/niwaringo/items/d2a30e04e08da8eaa643
+
+    Decoded by pandas' native CSV parser, cp932 is a superset of Shift-JIS used by Windows.
+    Undecodable bytes are replaced with U+FFFD by default, not dropped silently.
+
+    Arguments:
+        encoding: Encoding of the file, or 'auto' to detect by detect_text_encoding().
+        encoding_errors: How to handle decode errors, 'strict', 'replace' or 'ignore'.
+        chunksize: Returns iterator of data frames having chunksize rows if set.
     """
-    with codecs.open(filename, 'r', 'Shift-JIS', 'ignore') as file:
-        return pd.read_table(file, delimiter=',', **args)
+    if encoding == 'auto':
+        encoding = detect_text_encoding(filename) or 'cp932'
+    return pd.read_csv(filename, encoding=encoding, encoding_errors=encoding_errors,
+                       chunksize=chunksize, **args)
+
+def transcode_text_file(src, dst, src_encoding='cp932', dst_encoding='utf-8', errors='replace',
+                        buffer_bytes=16*1024*1024):
+    """Convert encoding of a text file, reading buffer_bytes at once.
+    Encoding is detected by detect_text_encoding() if src_encoding is 'auto'."""
+    if src_encoding == 'auto':
+        src_encoding = detect_text_encoding(src) or 'cp932'
+    decoder = codecs.getincrementaldecoder(src_encoding)(errors=errors)
+    with open(src, 'rb') as fin, open(dst, 'w', encoding=dst_encoding, newline='') as fout:
+        while True:
+            data = fin.read(buffer_bytes)
+            fout.write(decoder.decode(data, final=not data))
+            if not data:
+                break
 
 ## Dataset utilities
 
-from imblearn.over_sampling import RandomOverSampler
-from imblearn.under_sampling import RandomUnderSampler
-
 def flatten_y_if_onehot(y):
     """De-one-hot y, i.e. [0,1,0,0,...] to 1 for all y."""
     return y if len(np.array(y).shape) == 1 else np.argmax(y, axis = -1)
@@ -354,119 +654,370 @@ def get_class_distribution(y):
     # convert OH to index of class
     y_cls = flatten_y_if_onehot(y)
     # y_cls can be one of [index of class, class label name]
-    classset = sorted(list(set(y_cls)))
-    sample_distribution = {cur_cls:len([one for one in y_cls if one == cur_cls]) for cur_cls in classset}
-    return sample_distribution
+    classset, counts = np.unique(y_cls, return_counts=True)
+    return dict(zip(classset.tolist(), counts.tolist()))
 
 def get_class_distribution_list(y, num_classes):
     """Calculate number of samples per class as list"""
-    dist = get_class_distribution(y)
     assert(y[0].__class__ != str) # class index or class OH label only
-    list_dist = np.zeros((num_classes))
-    for i in range(num_classes):
-        if i in dist:
-            list_dist[i] = dist[i]
-    return list_dist
-
-def _balance_class(X, y, min_or_max, sampler_class, random_state):
-    """Balance class distribution with sampler_class."""
+    y_cls = np.asarray(flatten_y_if_onehot(y), dtype=np.int64)
+    return np.bincount(y_cls, minlength=num_classes)[:num_classes].astype(np.float64)
+
+def _random_state(random_state):
+    """Make np.random.RandomState from seed, or return as is if it is already RandomState."""
+    if isinstance(random_state, np.random.RandomState):
+        return random_state
+    return np.random.RandomState(random_state)
+
+def _resample_class_index(y_cls, target_counts, random_state):
+    """Make index array that samples `target_counts[i]` samples from i-th class of np.unique(y_cls).
+
+    Classes having more samples than target are randomly under-sampled without replacement,
+    ones having less keep all samples and add random samples with replacement.
+
+    Returns:
+        Sorted index array of resampled samples.
+    """
+    rng = _random_state(random_state)
+    _, inverse, counts = np.unique(y_cls, return_inverse=True, return_counts=True)
+    target_counts = np.asarray(target_counts, dtype=np.int64)
+    # Samples grouped by class, shuffled in each class
+    order = np.lexsort((rng.rand(len(inverse)), inverse))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    rank_in_class = np.arange(len(order)) - starts[inverse[order]]
+    kept = order[rank_in_class < target_counts[inverse[order]]]
+    # Additional samples with replacement
+    n_extra = np.maximum(target_counts - counts, 0)
+    extra_cls = np.repeat(np.arange(len(counts)), n_extra)
+    extra = order[starts[extra_cls] + (rng.rand(len(extra_cls)) * counts[extra_cls]).astype(np.int64)]
+    return np.sort(np.concatenate([kept, extra]))
+
+def sample_class_index(y, target_counts, random_state=42):
+    """Random over/under sampling to make number of samples per class as target, returns index array.
+
+    Arguments:
+        y: Class labels; index of class, class name or one-hot.
+        target_counts: Number of samples for all classes, or dict `{class: number}`.
+            Classes not in the dict keep their samples as is.
+        random_state: Seed or np.random.RandomState.
+
+    Returns:
+        Sorted index array of samples. Classes having more samples than target are sampled
+        without replacement, ones having less keep all and add samples with replacement.
+    """
+    y_cls = flatten_y_if_onehot(y)
+    classes, counts = np.unique(y_cls, return_counts=True)
+    if isinstance(target_counts, dict):
+        target_counts = [target_counts.get(cls, cnt) for cls, cnt in zip(classes.tolist(), counts)]
+    else:
+        target_counts = np.full(len(classes), target_counts)
+    return _resample_class_index(y_cls, target_counts, random_state)
+
+def stratified_sample_index(y, fraction, random_state=42):
+    """Sample fraction of samples from each class without replacement, returns index array.
+
+    Arguments:
+        y: Class labels; index of class, class name or one-hot.
+        fraction: Fraction (0, 1] for all classes, or dict `{class: fraction}`.
+            Classes not in the dict keep their samples as is.
+        random_state: Seed or np.random.RandomState.
+    """
+    y_cls = flatten_y_if_onehot(y)
+    classes, counts = np.unique(y_cls, return_counts=True)
+    if isinstance(fraction, dict):
+        fraction = [fraction.get(cls, 1.0) for cls in classes.tolist()]
+    target_counts = np.round(counts * np.minimum(fraction, 1.0)).astype(np.int64)
+    return _resample_class_index(y_cls, target_counts, random_state)
+
+def weighted_sample_index(y, n_samples, class_weights=None, replace=True, random_state=42):
+    """Sample index by weights of classes, returns index array.
+
+    Arguments:
+        y: Class labels; index of class, class name or one-hot.
+        n_samples: Number of samples to draw.
+        class_weights: Dict `{class: weight}`, classes not in the dict have weight 0.
+            None will draw all classes equally likely.
+        replace: Sample with replacement or not.
+        random_state: Seed or np.random.RandomState.
+    """
     y_cls = flatten_y_if_onehot(y)
-    distribution = get_class_distribution(y_cls)
-    classes = list(distribution.keys())
-    counts  = list(distribution.values())
+    classes, inverse, counts = np.unique(y_cls, return_inverse=True, return_counts=True)
+    weights = np.ones(len(classes)) if class_weights is None else \
+              np.array([class_weights.get(cls, 0.0) for cls in classes.tolist()], dtype=np.float64)
+    p = (weights / counts)[inverse]
+    return np.sort(_random_state(random_state).choice(len(y_cls), n_samples, replace=replace, p=p / p.sum()))
+
+def _balance_class_index(y, min_or_max, random_state):
+    """Balance class distribution by random over (max) or under (min) sampling, returns index array."""
+    y_cls = flatten_y_if_onehot(y)
+    _, counts = np.unique(y_cls, return_counts=True)
     nsamples = np.max(counts) if min_or_max == 'max' \
           else np.min(counts)
-    flat_ratio = {cls:nsamples for cls in classes}
-    Xidx = [[xidx] for xidx in range(len(X))]
-    sampler_instance = sampler_class(ratio=flat_ratio, random_state=random_state)
-    Xidx_resampled, y_cls_resampled = sampler_instance.fit_sample(Xidx, y_cls)
-    sampled_index = [idx[0] for idx in Xidx_resampled]
-    return np.array([X[idx] for idx in sampled_index]), np.array([y[idx] for idx in sampled_index])
-
-def balance_class_by_over_sampling(X, y, random_state=42):
-    """Balance class distribution with imbalanced-learn RandomOverSampler."""
-    return  _balance_class(X, y, 'max', RandomOverSampler, random_state)
+    return _resample_class_index(y_cls, np.full(len(counts), nsamples), random_state)
+
+def _balance_class(X, y, min_or_max, random_state, return_index):
+    """Balance class distribution, returns resampled X and y, or index array."""
+    index = _balance_class_index(y, min_or_max, random_state)
+    if return_index:
+        return index
+    return np.asarray(X)[index], np.asarray(y)[index]
+
+def balance_class_by_over_sampling(X, y, random_state=42, return_index=False):
+    """Balance class distribution by random over sampling, same as imbalanced-learn RandomOverSampler.
+    Returns index array of resampled samples instead of copies of X and y if return_index is True.
+    """
+    return  _balance_class(X, y, 'max', random_state, return_index)
 
-def balance_class_by_under_sampling(X, y, random_state=42):
-    """Balance class distribution with imbalanced-learn RandomUnderSampler."""
-    return  _balance_class(X, y, 'min', RandomUnderSampler, random_state)
+def balance_class_by_under_sampling(X, y, random_state=42, return_index=False):
+    """Balance class distribution by random under sampling, same as imbalanced-learn RandomUnderSampler.
+    Returns index array of resampled samples instead of copies of X and y if return_index is True.
+    """
+    return  _balance_class(X, y, 'min', random_state, return_index)
 
 def df_balance_class_by_over_sampling(df, label_column, random_state=42):
-    """Balance class distribution in DataFrame with imbalanced-learn RandomOverSampler."""
-    X, y = list(range(len(df))), list(df[label_column])
-    X, _ = balance_class_by_over_sampling(X, y, random_state=random_state)
-    return df.iloc[X].sort_index()
+    """Balance class distribution in DataFrame by random over sampling."""
+    index = _balance_class_index(df[label_column].values, 'max', random_state)
+    return df.iloc[index].sort_index()
 
 def df_balance_class_by_under_sampling(df, label_column, random_state=42):
-    """Balance class distribution in DataFrame with imbalanced-learn RandomUnderSampler."""
-    X, y = list(range(len(df))), list(df[label_column])
-    X, _ = balance_class_by_under_sampling(X, y, random_state=random_state)
-    return df.iloc[X].sort_index()
+    """Balance class distribution in DataFrame by random under sampling."""
+    index = _balance_class_index(df[label_column].values, 'min', random_state)
+    return df.iloc[index].sort_index()
+
+def df_sample_class(df, label_column, target_counts, random_state=42):
+    """DataFrame version of sample_class_index(), returns resampled DataFrame."""
+    return df.iloc[sample_class_index(df[label_column].values, target_counts, random_state)]
+
+def df_stratified_sample(df, label_column, fraction, random_state=42):
+    """DataFrame version of stratified_sample_index(), returns sampled DataFrame."""
+    return df.iloc[stratified_sample_index(df[label_column].values, fraction, random_state)]
+
+def df_weighted_sample(df, label_column, n_samples, class_weights=None, replace=True, random_state=42):
+    """DataFrame version of weighted_sample_index(), returns sampled DataFrame."""
+    return df.iloc[weighted_sample_index(df[label_column].values, n_samples, class_weights=class_weights,
+                                         replace=replace, random_state=random_state)]
 
 ## Visualization utilities
 
 def _expand_labels_from_y(y, labels):
     """Make sure y is index of label set."""
     if labels is None:
-        labels = sorted(list(set(y)))
-        y = [labels.index(_y) for _y in y]
+        y = np.asarray(flatten_y_if_onehot(y))
+        if y.dtype.kind in 'biuf':
+            labels, y = np.unique(y, return_inverse=True)
+        else:
+            # Hash based encoding is faster than sorting all strings
+            y, labels = pd.factorize(y, sort=True)
+        labels = labels.tolist()
     return y, labels
 
-def visualize_class_balance(title, y, labels=None, sorted=False):
+def class_balance_df(y, labels=None, sorted=False):
+    """Number of samples per class as data frame of columns: label, count, ratio.
+
+    Arguments:
+        y: Index of label, one-hot, or label names if labels is None.
+        labels: Label names for each index, or None to use sorted unique values of y.
+        sorted: Sort in descending order of count if True.
+    """
     y, labels = _expand_labels_from_y(y, labels)
-    sample_dist_list = get_class_distribution_list(y, len(labels))
+    counts = get_class_distribution_list(y, len(labels)).astype(np.int64) if len(y) else np.zeros(len(labels), dtype=np.int64)
+    df = pd.DataFrame({'label': labels, 'count': counts})
+    df['ratio'] = df['count'] / max(len(y), 1)
     if sorted:
-        items = list(zip(labels, sample_dist_list))
-        items.sort(key=lambda x:x[1], reverse=True)
-        sample_dist_list = [x[1] for x in items]
-        labels = [x[0] for x in items]
-    index = range(len(labels))
+        df = df.sort_values('count', ascending=False, kind='mergesort').reset_index(drop=True)
+    return df
+
+def visualize_class_balance(title, y, labels=None, sorted=False, save_to=None, max_tick_labels=100):
+    """Plot number of samples per class as bar chart.
+
+    Arguments:
+        save_to: Headless mode for batch jobs if set. Writes `save_to` with suffix .png for the chart
+            and .csv for class_balance_df(), without showing the figure.
+        max_tick_labels: Label names and bars are drawn up to this number of classes,
+            or counts are drawn as a filled step plot.
+    """
+    df = class_balance_df(y, labels, sorted)
+    index = np.arange(len(df))
     fig, ax = plt.subplots(1, 1, figsize = (16, 5))
-    ax.bar(index, sample_dist_list)
     ax.set_xlabel('Label')
-    ax.set_xticks(index)
-    ax.set_xticklabels(labels, rotation='vertical')
+    if len(df) <= max_tick_labels:
+        ax.bar(index, df['count'].values)
+        ax.set_xticks(index)
+        ax.set_xticklabels(df['label'].values, rotation='vertical')
+    else:
+        # One polygon instead of a bar patch per class
+        ax.fill_between(index, df['count'].values, step='mid')
     ax.set_ylabel('Number of Samples')
     ax.set_title(title)
-    fig.show()
+    if save_to is None:
+        fig.show()
+        return
+    save_to = Path(save_to)
+    ensure_folder(save_to.parent)
+    fig.savefig(save_to.with_suffix('.png'), bbox_inches='tight')
+    plt.close(fig)
+    df.to_csv(save_to.with_suffix('.csv'), index=False)
 
 from collections import OrderedDict
 def print_class_balance(title, y, labels=None, sorted=False):
-    y, labels = _expand_labels_from_y(y, labels)
-    distributions = get_class_distribution(y)
-    dist_dic = {labels[cls]:distributions[cls] for cls in distributions}
-    if sorted:
-        items = list(dist_dic.items())
-        items.sort(key=lambda x:x[1], reverse=True)
-        dist_dic = OrderedDict(items) # sorted(dist_dic.items(), key=...) didn't work for some reason...
-    print(title, '=', dist_dic)
-    zeroclasses = [label for i, label in enumerate(labels) if i not in distributions.keys()]
+    df = class_balance_df(y, labels, sorted)
+    nonzero = 0 < df['count'].values
+    dist_dic = OrderedDict(zip(df['label'].values[nonzero].tolist(), df['count'].values[nonzero].tolist()))
+    print(title, '=', dist_dic if sorted else dict(dist_dic))
+    zeroclasses = df['label'].values[~nonzero].tolist()
     if 0 < len(zeroclasses):
         print(' 0 sample classes:', zeroclasses)
 
-from sklearn.metrics import f1_score, precision_score, recall_score, accuracy_score
+def _integral_labels(y):
+    """Labels as int64 array if they are integers, integral floats or bools, or None."""
+    if y.dtype.kind in 'biu':
+        return y.astype(np.int64)
+    if y.dtype.kind == 'f' and np.all(np.mod(y, 1) == 0):
+        return y.astype(np.int64)
+    return None
+
+def _clf_label_index(y_true, y_pred):
+    """Flatten one-hot labels, and encode labels other than integers to index."""
+    y_true = np.asarray(flatten_y_if_onehot(y_true)).ravel()
+    y_pred = np.asarray(flatten_y_if_onehot(y_pred)).ravel()
+    int_true, int_pred = _integral_labels(y_true), _integral_labels(y_pred)
+    if int_true is not None and int_pred is not None:
+        if len(int_true) == 0 or 0 <= min(int_true.min(), int_pred.min()):
+            return int_true, int_pred
+        # Negative labels such as {-1, 1} are encoded in sorted order, 1 stays the last
+        y_true, y_pred = int_true, int_pred
+    _, index = np.unique(np.concatenate([y_true, y_pred]), return_inverse=True)
+    return index[:len(y_true)], index[len(y_true):]
+
+def clf_confusion_matrix(y_true, y_pred, num_classes=None):
+    """Calculate confusion matrix by one np.bincount() over `y_true * k + y_pred`.
+
+    Arguments:
+        y_true: GT, an index of label or one-hot encoding format.
+        y_pred: Prediction output, index or one-hot.
+        num_classes: Size of the matrix, or max label index + 1 if None.
+            Labels including negative values are encoded in sorted order.
+
+    Returns:
+        int64 array cm[true label, predicted label].
+    """
+    y_true, y_pred = _clf_label_index(y_true, y_pred)
+    k = num_classes or (int(max(y_true.max(), y_pred.max())) + 1 if len(y_true) else 0)
+    return np.bincount(y_true.astype(np.int64) * k + y_pred, minlength=k * k).reshape(k, k)
+
+def _safe_divide(a, b):
+    return np.divide(a, b, out=np.zeros(np.shape(a), dtype=np.float64), where=b != 0)
+
+def clf_metrics_from_confusion_matrix(cm, average='weighted'):
+    """Calculate metrics: f1/recall/precision/accuracy from confusion matrix.
+    Values match with sklearn.metrics functions, metrics divided by zero are 0.
+
+    Arguments:
+        cm: Confusion matrix cm[true label, predicted label].
+        average: 'binary' for label 1, 'micro', 'macro', 'weighted',
+            or None to get per-class arrays indexed by label.
+
+    Returns:
+        Four metrics: f1, recall, precision, accuracy.
+    """
+    cm = np.asarray(cm)
+    tp = np.diag(cm).astype(np.float64)
+    true_sum, pred_sum = cm.sum(axis=1), cm.sum(axis=0)
+    accuracy = float(_safe_divide(tp.sum(), cm.sum()))
+    if average == 'micro':
+        # Every sample is either right or wrong once
+        return accuracy, accuracy, accuracy, accuracy
+    recall = _safe_divide(tp, true_sum)
+    precision = _safe_divide(tp, pred_sum)
+    f1 = _safe_divide(2 * tp, true_sum + pred_sum)
+    if average is None:
+        return f1, recall, precision, accuracy
+    if average == 'binary':
+        return float(f1[1]), float(recall[1]), float(precision[1]), accuracy
+    if average == 'macro':
+        # Labels which appear in either y_true or y_pred only
+        weights = ((true_sum + pred_sum) > 0).astype(np.float64)
+    elif average == 'weighted':
+        weights = true_sum.astype(np.float64)
+    else:
+        raise ValueError(f'Unknown average: {average}')
+    n = weights.sum()
+    return tuple([float(np.dot(m, weights) / n) if 0 < n else 0. for m in [f1, recall, precision]] + [accuracy])
+
+def _clf_default_average(cm, average):
+    """Use 'binary' for binary classification, as sklearn functions do."""
+    return 'binary' if len(cm) <= 2 and average is not None else average
 
 def calculate_clf_metrics(y_true, y_pred, average='weighted'):
     """Calculate metrics: f1/recall/precision/accuracy.
+    All metrics are derived from one confusion matrix, see clf_confusion_matrix().
 
     # Arguments
         y_true: GT, an index of label or one-hot encoding format.
         y_pred: Prediction output, index or one-hot.
-        average: `average` parameter passed to sklearn.metrics functions.
+        average: 'micro', 'macro', 'weighted' as sklearn.metrics functions, or None for per-class.
 
     # Returns
         Four metrics: f1, recall, precision, accuracy.
     """
-    y_true = flatten_y_if_onehot(y_true)
-    y_pred = flatten_y_if_onehot(y_pred)
-    if np.max(y_true) < 2 and np.max(y_pred) < 2:
-        average = 'binary'
-
-    f1 = f1_score(y_true, y_pred, average=average)
-    recall = recall_score(y_true, y_pred, average=average)
-    precision = precision_score(y_true, y_pred, average=average)
-    accuracy = accuracy_score(y_true, y_pred)
-    return f1, recall, precision, accuracy
+    cm = clf_confusion_matrix(y_true, y_pred)
+    if len(cm) < 2:
+        cm = np.pad(cm, ((0, 2 - len(cm)), (0, 2 - len(cm))))
+    return clf_metrics_from_confusion_matrix(cm, average=_clf_default_average(cm, average))
+
+class ClfMetricsAccumulator:
+    """Accumulate confusion matrix over batches to calculate metrics of large data.
+    Labels are index of label or one-hot, negative labels are kept in sorted order in `labels`.
+
+    Usage:
+        acc = ClfMetricsAccumulator()
+        for X, y in batches:
+            acc.put(y, model.predict(X))
+        f1, recall, precision, accuracy = acc.metrics()
+    """
+    def __init__(self, num_classes=None):
+        # Label values of cm rows/columns: 0..k-1, or sorted values if negative labels are found
+        self.labels = np.arange(num_classes or 0)
+        self.cm = np.zeros((len(self.labels), len(self.labels)), dtype=np.int64)
+
+    def _ensure_labels(self, labels):
+        labels = np.union1d(self.labels, labels).astype(np.int64)
+        if 0 <= labels[0]:
+            labels = np.arange(labels[-1] + 1)
+        if len(labels) == len(self.labels):
+            return
+        pos = np.searchsorted(labels, self.labels)
+        cm = np.zeros((len(labels), len(labels)), dtype=np.int64)
+        cm[np.ix_(pos, pos)] = self.cm
+        self.labels, self.cm = labels, cm
+
+    def put(self, y_true, y_pred):
+        """Add a batch of labels (index or one-hot)."""
+        y_true = _integral_labels(np.asarray(flatten_y_if_onehot(y_true)).ravel())
+        y_pred = _integral_labels(np.asarray(flatten_y_if_onehot(y_pred)).ravel())
+        if y_true is None or y_pred is None:
+            # Encoding other labels per batch would not be consistent among batches
+            raise ValueError('Labels should be integer index or one-hot.')
+        if len(y_true) == 0:
+            return
+        values = np.concatenate([y_true, y_pred])
+        self._ensure_labels([values.max()] if 0 <= values.min() else np.unique(values))
+        if self.labels[0] < 0:
+            y_true, y_pred = np.searchsorted(self.labels, y_true), np.searchsorted(self.labels, y_pred)
+        self.cm += clf_confusion_matrix(y_true, y_pred, num_classes=len(self.cm))
+
+    def merge(self, other):
+        """Merge other accumulator, ex) accumulated in other process."""
+        self._ensure_labels(other.labels)
+        pos = np.searchsorted(self.labels, other.labels)
+        self.cm[np.ix_(pos, pos)] += other.cm
+
+    def metrics(self, average='weighted'):
+        """Returns f1, recall, precision, accuracy, same as calculate_clf_metrics()."""
+        cm = self.cm
+        if len(cm) < 2:
+            cm = np.pad(cm, ((0, 2 - len(cm)), (0, 2 - len(cm))))
+        return clf_metrics_from_confusion_matrix(cm, average=_clf_default_average(cm, average))
 
 def skew_bin_clf_preds(y_pred, binary_bias=None, logger=None):
     """Apply bias to prediction results for binary classification.
@@ -476,7 +1027,7 @@ def skew_bin_clf_preds(y_pred, binary_bias=None, logger=None):
     0 < binary_bias < 1 will be optimistic with result=1.
     Inversely, 1 < binary_bias will make results pesimistic.
     """
-    _preds = np.array(y_pred.copy())
+    _preds = np.array(y_pred)
     if binary_bias is not None:
         ps = np.power(_preds[:, 1], binary_bias)
         _preds[:, 1] = ps
@@ -485,12 +1036,72 @@ def skew_bin_clf_preds(y_pred, binary_bias=None, logger=None):
 #         logger.info(f' @skew{"+" if binary_bias >= 0 else ""}{binary_bias}')
     return _preds
 
+def _binary_scores(y_pred):
+    """Score of class 1 from 2-class prediction or 1D scores."""
+    y_pred = np.asarray(y_pred)
+    return y_pred[:, 1] if y_pred.ndim == 2 else y_pred
+
+def binary_threshold_sweep(y_true, y_pred, thresholds=None, binary_biases=None, chunk_size=4*1024*1024):
+    """Evaluate binary classification metrics for many thresholds at once.
+
+    Sample is predicted as 1 if score > threshold. Each sample is binned to thresholds
+    by np.searchsorted(), then reverse cumsum of the bin counts gives TP/FP for all thresholds.
+    Scores are processed by chunk_size samples to limit memory.
+
+    Arguments:
+        y_true: GT, an index of label or one-hot encoding format.
+        y_pred: Prediction output, probabilities of 2 classes or score of class 1.
+        thresholds: Thresholds to evaluate, all distinct scores if None (exact PR/ROC curve).
+        binary_biases: Evaluate binary_bias values of skew_bin_clf_preds() instead of thresholds,
+            bias b is the same as threshold 0.5 ** (1 / b).
+
+    Returns:
+        Data frame of metrics for each threshold in ascending order:
+        threshold, tp, fp, fn, tn, precision, recall, f1, accuracy, fpr (and binary_bias).
+    """
+    y_true = np.asarray(flatten_y_if_onehot(y_true)).ravel() == 1
+    scores = _binary_scores(y_pred)
+    if binary_biases is not None:
+        binary_biases = np.asarray(binary_biases, dtype=np.float64)
+        thresholds = np.power(0.5, 1 / binary_biases)
+    thresholds = np.unique(scores) if thresholds is None else np.asarray(thresholds)
+    order = np.argsort(thresholds, kind='mergesort')
+    sorted_thresholds = thresholds[order]
+
+    # Count samples by the number of thresholds below its score, for each class
+    counts = np.zeros(2 * (len(thresholds) + 1), dtype=np.int64)
+    for i in range(0, len(scores), chunk_size):
+        bins = np.searchsorted(sorted_thresholds, scores[i:i+chunk_size], side='left')
+        counts += np.bincount(bins * 2 + y_true[i:i+chunk_size], minlength=len(counts))
+    counts = counts.reshape(-1, 2).T
+    # Predicted 1 for threshold j if bin > j
+    fp, tp = [np.cumsum(c[::-1])[::-1][1:] for c in counts]
+    n_pos, n_neg = counts[1].sum(), counts[0].sum()
+    fn, tn = n_pos - tp, n_neg - fp
+    df = pd.DataFrame({'threshold': sorted_thresholds, 'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn,
+                       'precision': _safe_divide(tp, tp + fp), 'recall': _safe_divide(tp, n_pos),
+                       'f1': _safe_divide(2 * tp, 2 * tp + fp + fn),
+                       'accuracy': (tp + tn) / max(n_pos + n_neg, 1), 'fpr': _safe_divide(fp, n_neg)})
+    if binary_biases is not None:
+        df.insert(0, 'binary_bias', binary_biases[order])
+    return df
+
+def best_binary_threshold(y_true, y_pred, metric='f1', thresholds=None, binary_biases=None):
+    """Find the best threshold (or binary_bias) of binary classification by binary_threshold_sweep().
+
+    Returns:
+        Row of the sweep result with the best `metric` as pd.Series,
+        the smallest threshold is chosen among ties.
+    """
+    df = binary_threshold_sweep(y_true, y_pred, thresholds=thresholds, binary_biases=binary_biases)
+    return df.loc[df[metric].idxmax()]
+
 def print_clf_metrics(y_true, y_pred, average='weighted', binary_bias=None, title_prefix='', logger=None):
     """Calculate and print metrics: f1/recall/precision/accuracy.
     See calculate_clf_metrics() and skew_bin_clf_preds() for more detail.
     """
     # Add bias if binary_bias is set
-    _preds = skew_bin_clf_preds(y_pred, binary_bias, logger=logger)
+    _preds = y_pred if binary_bias is None else skew_bin_clf_preds(y_pred, binary_bias, logger=logger)
     # Calculate metrics
     f1, recall, precision, acc = calculate_clf_metrics(y_true, _preds, average=average)
     logger = get_logger() if logger is None else logger
@@ -516,24 +1127,93 @@ def plt_looks_good():
     plt.rcParams['xtick.labelsize'] = 10
     plt.rcParams['ytick.labelsize'] = 10
 
+def confusion_mass_order(cm):
+    """Class indexes in descending order of confusion mass,
+    number of samples wrongly predicted from or to each class."""
+    off_diag = cm - np.diag(np.diag(cm))
+    return np.argsort(-(off_diag.sum(axis=0) + off_diag.sum(axis=1)), kind='mergesort')
+
+def save_confusion_matrix(cm, filename, classes=None):
+    """Save confusion matrix as sparse non-zero cells.
+
+    Formats by suffix:
+        .csv: Long table of `true,pred,count` for non-zero cells, in descending order of count.
+        others: Compressed .npz with rows/cols/counts/shape/classes, read by load_confusion_matrix().
+    """
+    cm = np.asarray(cm)
+    rows, cols = np.nonzero(cm)
+    counts = cm[rows, cols]
+    if Path(filename).suffix.lower() == '.csv':
+        classes = np.arange(len(cm)) if classes is None else np.asarray(classes)
+        order = np.argsort(-counts, kind='mergesort')
+        pd.DataFrame({'true': classes[rows[order]], 'pred': classes[cols[order]],
+                      'count': counts[order]}).to_csv(filename, index=False)
+        return
+    with open(filename, 'wb') as f:
+        np.savez_compressed(f, rows=rows, cols=cols, counts=counts, shape=cm.shape,
+                            classes=np.array([] if classes is None else classes))
+
+def load_confusion_matrix(filename):
+    """Load confusion matrix saved by save_confusion_matrix() as .npz.
+
+    Returns:
+        Dense confusion matrix, and classes (None if not saved).
+    """
+    with np.load(filename) as data:
+        cm = np.zeros(data['shape'], dtype=data['counts'].dtype)
+        cm[data['rows'], data['cols']] = data['counts']
+        classes = list(data['classes']) if len(data['classes']) else None
+    return cm, classes
+
 # Thanks to http://scikit-learn.org/stable/auto_examples/model_selection/plot_confusion_matrix.html#sphx-glr-auto-examples-model-selection-plot-confusion-matrix-py
 import itertools
-from sklearn.metrics import confusion_matrix
 
 def plot_confusion_matrix(y_test, y_pred, classes,
                           normalize=True,
                           title=None,
-                          cmap=plt.cm.Blues):
-    """Plot confusion matrix."""
+                          cmap=None,
+                          cm=None,
+                          top_k=None,
+                          sort_by_confusion=False,
+                          max_text_classes=30,
+                          save_to=None):
+    """Plot confusion matrix. cmap is plt.cm.Blues if None.
+
+    Arguments:
+        cm: Confusion matrix made by clf_confusion_matrix(), used instead of y_test/y_pred if set.
+            Without cm, labels are index of classes, or sorted labels present if they exceed classes.
+        top_k: Show only k classes with the largest confusion mass, see confusion_mass_order().
+        sort_by_confusion: Show classes in descending order of confusion mass.
+        max_text_classes: Cell values and tick labels are drawn only up to this number of classes.
+        save_to: Save confusion matrix of all classes to the file, see save_confusion_matrix().
+    """
+    cmap = plt.cm.Blues if cmap is None else cmap
     po = np.get_printoptions()
     np.set_printoptions(precision=2)
 
-    y_test = flatten_y_if_onehot(y_test)
-    y_pred = flatten_y_if_onehot(y_pred)
-    cm = confusion_matrix(y_test, y_pred)
+    if cm is None:
+        cm = clf_confusion_matrix(y_test, y_pred)
+        if len(classes) < len(cm):
+            # Labels are not index of classes (ex. 1-based), count over labels present as sklearn does
+            y_test = np.asarray(flatten_y_if_onehot(y_test)).ravel()
+            y_pred = np.asarray(flatten_y_if_onehot(y_pred)).ravel()
+            _, index = np.unique(np.concatenate([y_test, y_pred]), return_inverse=True)
+            cm = clf_confusion_matrix(index[:len(y_test)], index[len(y_test):])
+    if len(classes) < len(cm):
+        raise ValueError(f'Confusion matrix has {len(cm)} classes, more than {len(classes)} classes given.')
+    if len(cm) < len(classes):
+        cm = np.pad(cm, ((0, len(classes) - len(cm)), (0, len(classes) - len(cm))))
+    if save_to is not None:
+        save_confusion_matrix(cm, save_to, classes=classes)
+
+    classes = np.asarray(classes)
+    if top_k is not None or sort_by_confusion:
+        order = confusion_mass_order(cm)[:top_k]
+        order = order if sort_by_confusion else np.sort(order)
+        cm, classes = cm[np.ix_(order, order)], classes[order]
 
     if normalize:
-        cm = cm.astype('float') / cm.sum(axis=1)[:, np.newaxis]
+        cm = _safe_divide(cm.astype('float'), cm.sum(axis=1)[:, np.newaxis])
         if title is None: title = 'Normalized confusion matrix'
     else:
         if title is None: title = 'Confusion matrix (not normalized)'
@@ -541,16 +1221,17 @@ def plot_confusion_matrix(y_test, y_pred, classes,
     plt.imshow(cm, interpolation='nearest', cmap=cmap)
     plt.title(title)
     plt.colorbar()
-    tick_marks = np.arange(len(classes))
-    plt.xticks(tick_marks, classes, rotation=45)
-    plt.yticks(tick_marks, classes)
-
-    fmt = '.2f' if normalize else 'd'
-    thresh = cm.max() / 2.
-    for i, j in itertools.product(range(cm.shape[0]), range(cm.shape[1])):
-        plt.text(j, i, format(cm[i, j], fmt),
-                 horizontalalignment="center",
-                 color="white" if cm[i, j] > thresh else "black")
+    if len(cm) <= max_text_classes:
+        tick_marks = np.arange(len(classes))
+        plt.xticks(tick_marks, classes, rotation=45)
+        plt.yticks(tick_marks, classes)
+
+        fmt = '.2f' if normalize else 'd'
+        thresh = cm.max() / 2.
+        for i, j in itertools.product(range(cm.shape[0]), range(cm.shape[1])):
+            plt.text(j, i, format(cm[i, j], fmt),
+                     horizontalalignment="center",
+                     color="white" if cm[i, j] > thresh else "black")
 
     plt.ylabel('True label')
     plt.xlabel('Predicted label')
@@ -1,4 +1,5 @@
 import unittest
+import time
 from dlcliche.utils import *
 from dlcliche.big_h5_array import *
 from dlcliche.test import *
@@ -10,6 +11,7 @@ class TestBigH5Array(unittest.TestCase):
     @classmethod
     def tearDownClass(self):
         ensure_delete('test.h5')
+        ensure_delete('test_shards')
 
     def do_test_as_normal_array(self, shape, testdata):
         # write test - just confirm no error
@@ -64,5 +66,222 @@ class TestBigH5Array(unittest.TestCase):
 
         print('')
 
+    def test_4_chunked_compressed(self):
+        shape = (TestBigH5Array.COL_SIZE, TestBigH5Array.ROW_SIZE)
+        testdata = np.random.rand(*shape).astype(np.float32)
+        for complib in [None, 'zlib', 'zstd', 'lz4']:
+            h5array = BigH5Array('test.h5', shape, chunkshape='auto', complib=complib,
+                                 chunk_cache_size=4*1024*1024, batch_rows=8)
+            h5array.open_for_write()
+            h5array()[...] = testdata
+            self.assertEqual(h5array().chunkshape, (8, TestBigH5Array.ROW_SIZE))
+            h5array.close()
+
+            h5array = BigH5Array('test.h5', chunk_cache_size=4*1024*1024)
+            h5array.open_for_read()
+            self.assertTrue(np.all(h5array()[5:13] == testdata[5:13]))
+            h5array.close()
+
+    def test_5_auto_chunkshape(self):
+        self.assertEqual(auto_chunkshape((1000, 10), 4, batch_rows=32), (32, 10))
+        self.assertEqual(auto_chunkshape((0, 10), 4, batch_rows=32), (32, 10))
+        self.assertEqual(auto_chunkshape((10, 10), 4, batch_rows=32), (10, 10))
+        self.assertEqual(auto_chunkshape((1000, 1024), 4, batch_rows=32, max_chunk_bytes=4096), (1, 1024))
+        self.assertEqual(auto_chunkshape((1000, 100, 1024), 4, max_chunk_bytes=4096*10), (1, 10, 1024))
+        with self.assertRaises(ValueError):
+            h5_filters('no-such-lib')
+
+    def test_6_lazy_array(self):
+        shape = (TestBigH5Array.COL_SIZE, 50, 3)
+        testdata = np.random.rand(*shape).astype(np.float32)
+        for contiguous in [False, True]:
+            h5array = BigH5Array('test.h5', shape, chunkshape='auto', batch_rows=4)
+            h5array.open_for_write(contiguous=contiguous)
+            h5array()[...] = testdata
+            h5array.close()
+
+            for mmap in [False, True]:
+                with big_h5_load('test.h5', lazy=True, mmap=mmap) as x:
+                    self.assertEqual(x.shape, shape)
+                    self.assertEqual(x.dtype, np.float32)
+                    self.assertEqual(len(x), TestBigH5Array.COL_SIZE)
+                    self.assertEqual(x.mm is not None, contiguous and mmap)
+                    self.assertTrue(np.all(x[3] == testdata[3]))
+                    self.assertTrue(np.all(x[-1] == testdata[-1]))
+                    self.assertTrue(np.all(x[2:10, 5:7] == testdata[2:10, 5:7]))
+                    index = [9, 2, 3, 4, 9, -1, 0]
+                    self.assertTrue(np.all(x[index] == testdata[index]))
+                    self.assertTrue(np.all(x[np.array(index), 1] == testdata[np.array(index), 1]))
+                    mask = testdata[:, 0, 0] > 0.5
+                    self.assertTrue(np.all(x[mask] == testdata[mask]))
+                    self.assertEqual(x[[]].shape, (0, 50, 3))
+                    self.assertTrue(np.all(np.array(x) == testdata))
+
+    def test_7_batch_iterator(self):
+        shape = (1000, 5)
+        testdata = np.arange(np.prod(shape)).reshape(shape).astype(np.float32)
+        h5array = BigH5Array('test.h5', shape, chunkshape=(50, 5))
+        h5array.open_for_write()
+        h5array()[...] = testdata
+        h5array.close()
+
+        # sequential
+        it = BigH5BatchIterator('test.h5', batch_size=64)
+        batches = list(it)
+        self.assertEqual(len(batches), len(it))
+        self.assertTrue(np.all(np.concatenate(batches) == testdata))
+        it.close()
+        # shuffled with prefetch, and without prefetch
+        for prefetch in [3, 0]:
+            it = BigH5BatchIterator('test.h5', batch_size=64, shuffle=True, drop_last=True,
+                                    with_index=True, prefetch=prefetch, random_state=1)
+            indexes = []
+            for index, X in it:
+                self.assertEqual(len(X), 64)
+                self.assertTrue(np.all(X == testdata[index]))
+                indexes.append(index)
+            indexes = np.concatenate(indexes)
+            self.assertEqual(len(indexes), 1000 // 64 * 64)
+            self.assertEqual(len(np.unique(indexes)), len(indexes))
+            self.assertFalse(np.all(indexes == np.arange(len(indexes))))
+            it.close()
+        # stopping iteration in the middle
+        with BigH5LazyArray('test.h5') as x:
+            it = BigH5BatchIterator(x, batch_size=10, prefetch=2)
+            for i, X in enumerate(it):
+                if i == 3: break
+            self.assertTrue(np.all(X == testdata[30:40]))
+
+    def test_7_batch_iterator_throughput(self):
+        shape = (20000, 64)
+        h5array = BigH5Array('test.h5', shape, chunkshape='auto', batch_rows=256)
+        h5array.open_for_write()
+        h5array()[...] = np.random.rand(*shape)
+        h5array.close()
+
+        def rows_per_sec(x, shuffle):
+            t = time.time()
+            for X in BigH5BatchIterator(x, batch_size=256, shuffle=shuffle, prefetch=0):
+                pass
+            return shape[0] / (time.time() - t)
+        with BigH5LazyArray('test.h5') as x:
+            sequential = max(rows_per_sec(x, False) for _ in range(3))
+            shuffled = max(rows_per_sec(x, True) for _ in range(3))
+        # shuffled reads whole chunks too, it should not fall to row-by-row speed
+        self.assertGreater(shuffled, sequential / 5)
+
+    def test_8_store(self):
+        X = np.random.rand(100, 4, 3).astype(np.float32)
+        y = np.arange(100)
+        ids = np.array(['id%d' % i for i in range(100)]).astype('S')
+        store = BigH5Store('test.h5', chunkshape='auto', complib='lz4', batch_rows=16)
+        store.open_for_write()
+        store.append(X=X[:30], y=y[:30], ids=ids[:30])
+        store.append(X=X[30:], y=y[30:], ids=ids[30:])
+        with self.assertRaises(ValueError):
+            store.append(X=X[:3], y=y[:2], ids=ids[:3])
+        with self.assertRaises(ValueError):
+            store.append(X=X[:3], y=y[:3])
+        store.close()
+
+        store.open_for_read()
+        self.assertEqual(sorted(store.names()), ['X', 'ids', 'y'])
+        self.assertEqual(len(store), 100)
+        index = [50, 3, 99, 4]
+        data = store.read_rows(index)
+        self.assertTrue(np.all(data['X'] == X[index]))
+        self.assertTrue(np.all(data['y'] == y[index]))
+        self.assertTrue(np.all(data['ids'] == ids[index]))
+        self.assertTrue(np.all(store['y'][10:20] == y[10:20]))
+        store.close()
+
+    def test_9_sharded_store(self):
+        X = np.random.rand(1000, 8).astype(np.float32)
+        y = np.arange(1000)
+        # 8*4 + 8 = 40 bytes per row, 100 rows per shard
+        shards = BigH5ShardedStore('test_shards', max_shard_bytes=4000)
+        shards.open_for_write()
+        for i in range(0, 1000, 70):
+            shards.append(X=X[i:i+70], y=y[i:i+70])
+        shards.close()
+        self.assertEqual(len(shards.shard_files()), 10)
+
+        shards = BigH5ShardedStore('test_shards')
+        shards.open_for_read()
+        self.assertEqual(len(shards), 1000)
+        self.assertEqual(shards.lengths, [100] * 10)
+        index = [999, 0, 150, 151, 420, -1, 99, 100]
+        for num_workers in [None, 3]:
+            data = shards.read_rows(index, num_workers=num_workers)
+            self.assertTrue(np.all(data['X'] == X[index]))
+            self.assertTrue(np.all(data['y'] == y[index]))
+        self.assertEqual(shards.read_rows([])['X'].shape, (0, 8))
+        shards.close()
+
+    def test_10_buffered_append(self):
+        testdata = np.random.rand(1000, 7).astype(np.float32)
+        for buffer_rows in ['chunk', 64, None]:
+            with BigH5Array('test.h5', (0, 7), chunkshape=(32, 7)) as writer:
+                writer.open_for_write_expandable(buffer_rows=buffer_rows)
+                for i in range(500):  # row by row
+                    writer.append(testdata[i])
+                writer.append(testdata[500:503])
+                writer.append(testdata[503:900])  # large block
+                for i in range(900, 1000, 5):
+                    writer.append(testdata[i:i+5])
+            with BigH5LazyArray('test.h5') as x:
+                self.assertTrue(np.all(x[:] == testdata))
+
+    def test_11_queue_writer(self):
+        testdata = np.random.rand(300, 7).astype(np.float32)
+        with BigH5QueueWriter('test.h5', (0, 7), complib='zlib') as writer:
+            procs = [Process(target=_put_rows, args=(writer.queue, testdata[i::3])) for i in range(3)]
+            [p.start() for p in procs]
+            [p.join() for p in procs]
+            writer.put(testdata[:1])
+        x = big_h5_load('test.h5')
+        self.assertEqual(x.shape, (301, 7))
+        # order among workers is not deterministic
+        self.assertTrue(np.allclose(np.sort(x[:-1], axis=0), np.sort(testdata, axis=0)))
+
+        writer = BigH5QueueWriter('test.h5', (0, 7), max_queue=4)
+        writer.put(np.zeros((2, 3)))  # wrong shape
+        # Workers don't block on the full queue after the failure
+        proc = Process(target=_put_rows, args=(writer.queue, testdata))
+        proc.start()
+        proc.join(timeout=30)
+        self.assertFalse(proc.is_alive())
+        with self.assertRaises(Exception):
+            writer.close()
+
+    def test_12_stats_normalize(self):
+        testdata = (np.random.randn(5000, 3, 2) * [[1, 2]] + [[10, -5]]).astype(np.float32)
+        with BigH5Array('test.h5', testdata.shape) as writer:
+            writer.open_for_write()
+            writer()[...] = testdata
+        for num_workers in [None, 2]:
+            stats = big_h5_stats('test.h5', block_rows=700, quantiles=[0.1, 0.5, 0.9], num_workers=num_workers)
+            self.assertEqual(stats['count'], 5000)
+            self.assertTrue(np.allclose(stats['mean'], testdata.mean(axis=0), atol=1e-5))
+            self.assertTrue(np.allclose(stats['var'], testdata.astype(np.float64).var(axis=0, ddof=1)))
+            self.assertTrue(np.all(stats['min'] == testdata.min(axis=0)))
+            self.assertTrue(np.all(stats['max'] == testdata.max(axis=0)))
+            self.assertEqual(stats['hist'].shape, (6, 1024))
+            self.assertTrue(np.all(stats['hist'].sum(axis=1) == 5000))
+            ref = np.quantile(testdata, [0.1, 0.5, 0.9], axis=0)
+            self.assertTrue(np.allclose(stats['quantiles'], ref, atol=0.05))
+
+        mean, std = big_h5_normalize('test.h5', 'test_norm.h5', block_rows=999, complib='lz4')
+        x = big_h5_load('test_norm.h5')
+        ensure_delete('test_norm.h5')
+        self.assertTrue(np.allclose(x, (testdata - mean) / std, atol=1e-5))
+        self.assertTrue(np.allclose(x.mean(axis=0), 0, atol=1e-4))
+        self.assertTrue(np.allclose(x.std(axis=0, ddof=1), 1, atol=1e-4))
+
+
+def _put_rows(q, rows):
+    for row in rows:
+        q.put(row)
+
 if __name__ == '__main__':
     unittest.main()
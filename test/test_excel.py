@@ -12,11 +12,12 @@ file_folder = Path(__file__).parent
 class TestExcel(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
-        pass
+        cls.tmp_folder = Path('_tmp_excel')
+        ensure_folder(cls.tmp_folder)
 
     @classmethod
     def tearDownClass(cls):
-        pass
+        ensure_delete(cls.tmp_folder)
 
     def setUp(self):
         pass
@@ -37,5 +38,69 @@ class TestExcel(unittest.TestCase):
         # Test
         self.assertTrue(test_exactly_same_df('df_merge_update test', ref_df, df))
 
+    def test_df_merge_update_files(self):
+        files = [file_folder/f'data/{date(2018, 11, d)}.csv' for d in range(17, 22)]
+        ref_df = df_merge_update([df_load_excel_like(f).set_index('created') for f in files])
+        for base_file in [self.tmp_folder/'merge_base.csv', self.tmp_folder/'merge_base.pkl',
+                          self.tmp_folder/'merge_base.xlsx']:
+            ensure_delete(base_file)
+            # Apply deltas incrementally to a file on disk
+            df_merge_update_files(base_file, files[:2], index_col='created', batch_files=1)
+            df = df_merge_update_files(base_file, files[2:], index_col='created', batch_files=2)
+            self.assertTrue(test_exactly_same_df('df_merge_update_files test', ref_df, df))
+            df = df_merge_update_files(base_file, [], index_col='created')
+            self.assertTrue(test_exactly_same_df('df_merge_update_files reload test', ref_df, df))
+            ensure_delete(base_file)
+        # Index is the 1st column by default
+        base_file = self.tmp_folder/'merge_base.csv'
+        df = df_merge_update_files(base_file, files[:2])
+        self.assertEqual(df.index.name, 'created')
+        self.assertEqual(len(df), len(df_merge_update([d.set_index('created') for d in
+                                                       [df_load_excel_like(f) for f in files[:2]]])))
+        ensure_delete(base_file)
+        # .xls cannot be written
+        with self.assertRaises(ValueError):
+            df_merge_update_files(self.tmp_folder/'merge_base.xls', files[:2])
+
+    def test_df_load_excel_like_options(self):
+        filename = file_folder/'data/2018-11-17.csv'
+        ref_df = df_load_excel_like(filename)
+        # Chunked
+        chunks = list(df_load_excel_like(filename, chunksize=20))
+        self.assertTrue(1 < len(chunks))
+        self.assertTrue(test_exactly_same_df('chunked test', ref_df, pd.concat(chunks)))
+        # usecols and str_dtype
+        df = df_load_excel_like(filename, usecols=ref_df.columns[:2], str_dtype='category')
+        self.assertEqual(list(df.columns), list(ref_df.columns[:2]))
+        self.assertTrue(all(str(t) == 'category' for t in df.dtypes))
+        self.assertTrue(df.astype(object).equals(ref_df[ref_df.columns[:2]]))
+        # Cache
+        cache_folder = self.tmp_folder/'df_cache'
+        ensure_delete(cache_folder)
+        df = df_load_excel_like(filename, cache=True, cache_folder=cache_folder)
+        cache_file = df_load_cache_file(filename, cache_folder=cache_folder, preserve_dtype=True, str_dtype=None)
+        self.assertTrue(cache_file.exists())
+        self.assertTrue(test_exactly_same_df('cache test', ref_df, df))
+        df = df_load_excel_like(filename, cache=True, cache_folder=cache_folder)
+        self.assertTrue(test_exactly_same_df('cache hit test', ref_df, df))
+        # Caches of other options and same-named files in other folders coexist,
+        # and only caches of older contents of the same file are removed
+        copies = [self.tmp_folder/'cache_a'/filename.name, self.tmp_folder/'cache_b'/filename.name]
+        for copy in copies:
+            ensure_folder(copy.parent)
+            shutil.copy(filename, copy)
+            df_load_excel_like(copy, cache=True, cache_folder=cache_folder)
+        df_load_excel_like(copies[0], str_dtype='category', cache=True, cache_folder=cache_folder)
+        self.assertEqual(len(list(cache_folder.glob('*.pkl'))), 4)
+        stat = copies[1].stat()
+        os.utime(copies[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        df_load_excel_like(copies[1], cache=True, cache_folder=cache_folder)
+        self.assertEqual(len(list(cache_folder.glob('*.pkl'))), 4)
+        self.assertTrue(df_load_cache_file(copies[1], cache_folder=cache_folder,
+                                           preserve_dtype=True, str_dtype=None).exists())
+        ensure_delete(cache_folder)
+        for copy in copies:
+            ensure_delete(copy.parent)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from dlcliche.image import *
+
+tmp_folder = Path('_tmp_image')
+src_folder = tmp_folder/'src'
+dest_folder = tmp_folder/'dest'
+
+class TestImage(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        ensure_folder(src_folder)
+        for i in range(20):
+            cv2.imwrite(str(src_folder/f'{i}.png'), np.random.randint(0, 255, (32, 24, 3), dtype=np.uint8))
+        (src_folder/'broken.png').write_text('not an image')
+
+    @classmethod
+    def tearDownClass(cls):
+        ensure_delete(tmp_folder)
+
+    def test_resize_image_files(self):
+        ensure_delete(dest_folder)
+        ensure_delete(tmp_folder/'dest.resize_manifest.jsonl')
+        files = sorted(src_folder.glob('*.png'))
+        for backend in ['process', 'thread']:
+            # Broken file fails after all other files are done
+            with self.assertRaises(RuntimeError):
+                resize_image_files(dest_folder, files, shape=(8, 8), num_threads=2, backend=backend)
+            returns = resize_image_files(dest_folder, files, shape=(8, 8), num_threads=2, backend=backend,
+                                         on_error='collect')
+            self.assertEqual(returns[0], (str(dest_folder/files[0].name), (24, 32)))
+            self.assertIn((str(src_folder/'broken.png'), None), returns)
+            self.assertEqual(cv2.imread(str(dest_folder/files[0].name)).shape, (8, 8, 3))
+        # No manifest unless resume or manifest is set
+        self.assertFalse((tmp_folder/'dest.resize_manifest.jsonl').exists())
+        self.assertEqual(len(list(dest_folder.glob('*.jsonl'))), 0)
+
+    def test_resize_image_files_resume(self):
+        ensure_delete(dest_folder)
+        files = sorted(src_folder.glob('[0-9]*.png'))
+        manifest = tmp_folder/'dest.resize_manifest.jsonl'
+        ensure_delete(manifest)
+        resize_image_files(dest_folder, files[:10], shape=(8, 8), num_threads=2, resume=True)
+        self.assertEqual(len(manifest.read_text().splitlines()), 10)
+        # Only new files are processed
+        returns = resize_image_files(dest_folder, files, shape=(8, 8), num_threads=2, resume=True)
+        self.assertEqual(len(returns), 20)
+        self.assertTrue(all(size == (24, 32) for _, size in returns))
+        self.assertEqual(len(manifest.read_text().splitlines()), 20)
+        # Deleted output and changed shape are processed again
+        (dest_folder/files[0].name).unlink()
+        resize_image_files(dest_folder, files, shape=(8, 8), num_threads=2, resume=True)
+        self.assertEqual(len(manifest.read_text().splitlines()), 21)
+        resize_image_files(dest_folder, files[:5], shape=(4, 4), num_threads=2, resume=True)
+        self.assertEqual(len(manifest.read_text().splitlines()), 26)
+        self.assertEqual(cv2.imread(str(dest_folder/files[0].name)).shape, (4, 4, 3))
+        # Manifest is rewritten if not resuming
+        resize_image_files(dest_folder, files[:3], shape=(8, 8), num_threads=2, manifest=manifest)
+        self.assertEqual(len(manifest.read_text().splitlines()), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -39,6 +39,175 @@ class TesMath(unittest.TestCase):
         self.assertTrue(np.all([is_in_range(v, amin=1.7, amax=2.2) for v in onstat.sigma()]))
         self.assertEqual(onstat.count(), n)
 
+    def test_online_stats_batch_merge(self):
+        k = 20
+        a = (np.random.randn(3000, k) * np.arange(1, k + 1) + 1000).astype(np.float32)
+        ref_mean, ref_var = a.astype(np.float64).mean(axis=0), a.astype(np.float64).var(axis=0, ddof=1)
+
+        onstat = OnlineStats(k)
+        onstat.put_batch(a, block_rows=700)
+        self.assertEqual(onstat.count(), 3000)
+        self.assertEqual(onstat.mean().dtype, np.float64)
+        self.assertTrue(np.allclose(onstat.mean(), ref_mean))
+        self.assertTrue(np.allclose(onstat.variance(), ref_var))
+
+        # Stats of shards merged
+        shards = [OnlineStats(k) for _ in range(3)]
+        shards[0].put_batch(a[:100])
+        for x in a[100:1000]:
+            shards[1].put(x)
+        shards[2].put_batch(a[1000:])
+        merged = OnlineStats(k).merge(shards[0]).merge(OnlineStats(k)).merge(shards[1]).merge(shards[2])
+        self.assertEqual(merged.count(), 3000)
+        self.assertTrue(np.allclose(merged.mean(), ref_mean))
+        self.assertTrue(np.allclose(merged.variance(), ref_var))
+        # undo still works after merge
+        merged.undo(a[-1])
+        self.assertTrue(np.allclose(merged.variance(), a[:-1].astype(np.float64).var(axis=0, ddof=1)))
+
+
+    def test_online_moments(self):
+        from scipy import stats
+        a = np.column_stack([np.random.randn(20000), np.random.exponential(size=20000), np.random.rand(20000)])
+        shards = [OnlineMoments(3, sketch_k=256, random_state=i) for i in range(3)]
+        shards[0].put_batch(a[:5000])
+        for x in a[5000:5100]:
+            shards[1].put(x)
+        shards[2].put_batch(a[5100:])
+        m = shards[0].merge(shards[1]).merge(shards[2])
+        self.assertEqual(m.count(), 20000)
+        self.assertTrue(np.allclose(m.mean(), a.mean(axis=0)))
+        self.assertTrue(np.allclose(m.variance(), a.var(axis=0, ddof=1)))
+        self.assertTrue(np.allclose(m.skewness(), stats.skew(a)))
+        self.assertTrue(np.allclose(m.kurtosis(), stats.kurtosis(a)))
+        self.assertTrue(np.all(m.min == a.min(axis=0)))
+        self.assertTrue(np.all(m.max == a.max(axis=0)))
+        qs = [0.01, 0.25, 0.5, 0.75, 0.99]
+        # Rank error should be small
+        ranks = (a[np.newaxis] <= m.quantile(qs)[:, np.newaxis]).mean(axis=1)
+        self.assertTrue(np.all(np.abs(ranks - np.array(qs)[:, np.newaxis]) < 0.02))
+        self.assertEqual(m.quantile(0.5).shape, (3,))
+        # Bounded memory
+        self.assertTrue(sum([len(l) for l in m.sketch.levels]) < 256 * 10)
+
+    def test_rolling_windowed_ewm(self):
+        x = np.random.randn(1000, 3) + 1e6
+        df = pd.DataFrame(x)
+        ref_mean = df.rolling(50).mean().values[49:]
+        ref_var = df.rolling(50).var().values[49:]
+        self.assertTrue(np.allclose(rolling_mean(x, 50, block_rows=100), ref_mean))
+        self.assertTrue(np.allclose(rolling_var(x, 50, block_rows=100), ref_var))
+        self.assertTrue(np.allclose(running_mean(x[:, 0], 50), ref_mean[:, 0]))
+        self.assertEqual(rolling_mean(x[:10], 50).shape, (0, 3))
+
+        wstats = WindowedStats(3, 50)
+        for i, _x in enumerate(x):
+            wstats.put(_x)
+            if i == 20:
+                self.assertTrue(np.allclose(wstats.mean(), x[:21].mean(axis=0)))
+            if i in [49, 123, 999]:
+                self.assertTrue(np.allclose(wstats.mean(), ref_mean[i - 49]))
+                self.assertTrue(np.allclose(wstats.variance(), ref_var[i - 49]))
+        self.assertEqual(wstats.count(), 50)
+
+        ewm = EWMStats(3, span=20)
+        ewm.put_batch(x)
+        self.assertTrue(np.allclose(ewm.mean(), df.ewm(span=20, adjust=False).mean().values[-1]))
+        self.assertTrue(np.allclose(ewm.variance(), df.ewm(span=20, adjust=False).var(bias=True).values[-1]))
+
+    def test_ensemble(self):
+        list_preds = [np_softmax(np.random.randn(1000, 5)) for _ in range(4)]
+        weights = [1.0, 2.0, 0.5, 1.5]
+        ref_geo = np.exp(np.sum([w * np.log(p) for w, p in zip(weights, list_preds)], axis=0) / np.sum(weights))
+        ref_ari = np.sum([w * p for w, p in zip(weights, list_preds)], axis=0) / np.sum(weights)
+        self.assertTrue(np.allclose(geometric_mean_preds(list_preds),
+                                    np.exp(np.mean([np.log(p) for p in list_preds], axis=0))))
+
+        # underflow with many models
+        tiny = [np.full((2, 2), 1e-20)] * 50
+        self.assertTrue(np.allclose(geometric_mean_preds(tiny), 1e-20))
+        ens = EnsembleAccumulator('geometric')
+        for p in tiny:
+            ens.put(p)
+        self.assertTrue(np.allclose(ens.result(), 1e-20))
+
+        for method, ref in [('geometric', ref_geo), ('arithmetic', ref_ari)]:
+            ens = EnsembleAccumulator(method, chunk_rows=300)
+            ens.put(list_preds[0], weight=weights[0])
+            ens.put((list_preds[1][i:i+128] for i in range(0, 1000, 128)), weight=weights[1])  # generator
+            ens.put(list_preds[2].tolist(), weight=weights[2])
+            ens.put(list_preds[3], weight=weights[3])
+            self.assertEqual(ens.count(), 4)
+            self.assertTrue(np.allclose(ens.result(), ref))
+            self.assertTrue(np.allclose(ensemble_preds(list_preds, weights, method=method, chunk_rows=300), ref))
+            out = np.zeros((1000, 5))
+            ensemble_preds(list_preds, weights, method=method, chunk_rows=128, out=out)
+            self.assertTrue(np.allclose(out, ref))
+
+        ens = EnsembleAccumulator('rank')
+        ens.put(np.array([[0.1], [0.5], [0.3]]))
+        ens.put(np.array([[0.2], [0.9], [0.8]]), weight=3)
+        self.assertTrue(np.allclose(ens.result(), [[0.0], [1.0], [0.5]]))
+        with self.assertRaises(ValueError):
+            EnsembleAccumulator('median')
+        for rows in [4, 6]:
+            with self.assertRaises(ValueError):
+                ensemble_preds([np.ones((8, 2)), np.ones((rows, 2))], chunk_rows=4)
+
+    def test_softmax(self):
+        def ref_softmax(z, axis):
+            e = np.exp(z - np.max(z, axis=axis, keepdims=True))
+            return e / e.sum(axis=axis, keepdims=True)
+        z = np.random.randn(50, 7, 3) * 100
+        for axis in [0, 1, 2, -1]:
+            self.assertTrue(np.allclose(np_softmax(z, axis=axis), ref_softmax(z, axis)))
+            self.assertTrue(np.allclose(np_log_softmax(z, axis=axis), np.log(ref_softmax(z, axis))))
+            self.assertTrue(np.allclose(np_logsumexp(z, axis=axis),
+                                        np.log(np.sum(np.exp(z - z.max()), axis=axis)) + z.max()))
+        z32 = z.reshape(-1, 3).astype(np.float32)
+        self.assertEqual(np_softmax(z32).dtype, np.float32)
+        self.assertTrue(np.allclose(np_softmax(z32), ref_softmax(z32.astype(np.float64), 1), atol=1e-6))
+        self.assertEqual(np_softmax(np.array([[1, 2]])).dtype, np.float64)
+        out = np.empty_like(z32)
+        self.assertTrue(np_softmax(z32, out=out) is out)
+        expected = np_softmax(z32)
+        self.assertTrue(np_softmax(z32, inplace=True) is z32)
+        self.assertTrue(np.allclose(z32, expected))
+        big = np.random.randn(1000, 10).astype(np.float32)
+        self.assertTrue(np.allclose(np_softmax_chunked(big, chunk_rows=333), np_softmax(big)))
+        self.assertTrue(np.allclose(np_softmax_chunked(big, chunk_rows=64, log=True), np_log_softmax(big), atol=1e-5))
+
+    def test_describe(self):
+        a = np.random.randn(2000, 4)
+        a[3, 1] = np.nan
+        ref = pd.DataFrame(pd.Series(a.ravel()).describe()).transpose()
+        self.assertTrue(np.allclose(np_describe(a).values, ref.values))
+        self.assertEqual(list(np_describe(a).columns), list(ref.columns))
+        ref = pd.DataFrame(a).describe().transpose()
+        self.assertTrue(np.allclose(np_describe(a, axis=0).values, ref.values))
+        self.assertEqual(list(np_describe(a, axis=0, percentiles=[0.1]).columns),
+                         ['count', 'mean', 'std', 'min', '10%', 'max'])
+        approx = np_describe(a[:, 0], sample=500, random_state=1)
+        self.assertEqual(approx['count'][0], 2000)
+        self.assertTrue(abs(approx['50%'][0] - np.median(a[:, 0])) < 0.2)
+
+        b = np.random.randn(5000, 3)
+        stream = np_describe_stream((b[i:i+1000] for i in range(0, 5000, 1000)), axis=0)
+        ref = np_describe(b, axis=0)
+        self.assertTrue(np.allclose(stream[['count', 'mean', 'std', 'min', 'max']],
+                                    ref[['count', 'mean', 'std', 'min', 'max']]))
+        self.assertTrue(np.allclose(stream[['25%', '50%', '75%']], ref[['25%', '50%', '75%']], atol=0.1))
+
+        ref = pd.DataFrame(b[:10].T).describe().transpose()
+        self.assertTrue(np.allclose(np_describe(b[:10], axis=1).values, ref.values))
+        stream = np_describe_stream((b[i:min(i+3, 10)] for i in range(0, 10, 3)), axis=1)
+        self.assertTrue(np.allclose(stream.values, ref.values))
+        with self.assertRaises(ValueError):
+            np_describe(b, axis=2)
+        with self.assertRaises(ValueError):
+            np_describe_stream(b, axis=-1)
+        with self.assertRaises(ValueError):
+            np_describe_stream(iter([]))
 
 if __name__ == '__main__':
     unittest.main()
@@ -185,6 +185,244 @@ class TestUtils(unittest.TestCase):
         self.assertAlmostEqual(precision, 1.0)
         self.assertAlmostEqual(acc, 0.6666666666666666)
 
+        # Accumulated over batches, and other averages
+        gts, preds = np.random.RandomState(0).randint(0, 4, (2, 100))
+        accumulator, other = ClfMetricsAccumulator(), ClfMetricsAccumulator()
+        for i in range(0, 60, 6):
+            accumulator.put(gts[i:i+6], preds[i:i+6])
+        other.put(gts[60:], np.eye(N=4)[preds[60:]])
+        accumulator.merge(other)
+        self.assertTrue(np.array_equal(accumulator.cm, clf_confusion_matrix(gts, preds)))
+        from sklearn.metrics import f1_score, precision_score, recall_score
+        for average in ['micro', 'macro', 'weighted']:
+            f1, recall, precision, acc = accumulator.metrics(average=average)
+            self.assertAlmostEqual(f1, f1_score(gts, preds, average=average))
+            self.assertAlmostEqual(recall, recall_score(gts, preds, average=average))
+            self.assertAlmostEqual(precision, precision_score(gts, preds, average=average))
+            self.assertAlmostEqual(acc, np.mean(gts == preds))
+        f1, recall, precision, acc = calculate_clf_metrics(gts, preds, average=None)
+        self.assertTrue(np.allclose(f1, f1_score(gts, preds, average=None)))
+        # Integral float labels are the same as integers, other labels can't be accumulated
+        accumulator = ClfMetricsAccumulator()
+        accumulator.put([0, 2], [0., 2.])
+        self.assertTrue(np.array_equal(accumulator.cm, np.diag([1, 0, 1])))
+        with self.assertRaises(ValueError):
+            accumulator.put(['a'], ['b'])
+        # Negative labels, {-1, 1} is binary with positive label 1 as sklearn
+        gts, preds = [-1, 1, 1, -1], [-1, 1, -1, -1]
+        f1, recall, precision, acc = calculate_clf_metrics(gts, preds)
+        self.assertAlmostEqual(f1, f1_score(gts, preds))
+        self.assertAlmostEqual(recall, recall_score(gts, preds))
+        accumulator = ClfMetricsAccumulator()
+        accumulator.put(gts[:2], preds[:2])
+        accumulator.put(gts[2:], preds[2:])
+        self.assertTrue(np.array_equal(accumulator.metrics(), (f1, recall, precision, acc)))
+        gts, preds = np.random.RandomState(1).randint(-2, 3, (2, 100))
+        accumulator, other = ClfMetricsAccumulator(), ClfMetricsAccumulator()
+        accumulator.put(np.abs(gts[:50]), np.abs(preds[:50]))
+        accumulator.put(gts[50:70], preds[50:70])
+        other.put(gts[70:], preds[70:])
+        accumulator.merge(other)
+        gts[:50], preds[:50] = np.abs(gts[:50]), np.abs(preds[:50])
+        self.assertTrue(np.array_equal(accumulator.labels, [-2, -1, 0, 1, 2]))
+        self.assertTrue(np.array_equal(accumulator.cm, clf_confusion_matrix(gts, preds)))
+        f1, recall, precision, acc = accumulator.metrics(average='macro')
+        self.assertAlmostEqual(f1, f1_score(gts, preds, average='macro'))
+
+    def test_binary_threshold_sweep(self):
+        gts = [1, 0, 1]
+        results = np.array([[0.4, 0.6], [0.6, 0.4], [0.3, 0.7]])
+        df = binary_threshold_sweep(gts, results, thresholds=[0.65, 0.5, 0.3])
+        self.assertEqual(list(df.threshold), [0.3, 0.5, 0.65])
+        self.assertEqual(list(df.tp), [2, 2, 1])
+        self.assertEqual(list(df.fp), [1, 0, 0])
+        self.assertTrue(np.allclose(df.f1, [0.8, 1.0, 0.6666666666666666]))
+        self.assertTrue(np.allclose(df.fpr, [1.0, 0.0, 0.0]))
+        # Same as skew_bin_clf_preds()
+        df = binary_threshold_sweep(gts, results, binary_biases=[0.5, 1.5])
+        for bias, f1 in zip(df.binary_bias, df.f1):
+            self.assertAlmostEqual(f1, calculate_clf_metrics(gts, skew_bin_clf_preds(results, bias))[0])
+        best = best_binary_threshold(gts, results[:, 1])
+        self.assertEqual(best.threshold, 0.4)
+        self.assertEqual(best.f1, 1.0)
+
+    def test_confusion_matrix(self):
+        gts, preds = np.random.RandomState(0).randint(0, 50, (2, 1000))
+        npz_file, csv_file = self.tmp_folder/'cm.npz', self.tmp_folder/'cm.csv'
+        cm = clf_confusion_matrix(gts, np.eye(50)[preds])
+        self.assertEqual(cm.sum(), 1000)
+        self.assertTrue(0 < cm[gts[0], preds[0]])
+        save_confusion_matrix(cm, npz_file, classes=[f'c{i}' for i in range(50)])
+        loaded, classes = load_confusion_matrix(npz_file)
+        self.assertTrue(np.array_equal(cm, loaded))
+        self.assertEqual(classes[:2], ['c0', 'c1'])
+        save_confusion_matrix(cm, csv_file)
+        df = pd.read_csv(csv_file)
+        self.assertEqual(df['count'].sum(), 1000)
+        self.assertEqual(df['count'].iloc[0], cm.max())
+        order = confusion_mass_order(cm)
+        mass = cm.sum(axis=0) + cm.sum(axis=1) - 2 * np.diag(cm)
+        self.assertTrue(np.all(np.diff(mass[order]) <= 0))
+        # Large matrix without cell texts, and top-k confused classes
+        plot_confusion_matrix(None, None, classes=list(range(50)), cm=cm)
+        plt.close()
+        plot_confusion_matrix(gts, preds, classes=list(range(50)), top_k=5, sort_by_confusion=True)
+        plt.close()
+        # 1-based labels are counted over the labels present
+        plot_confusion_matrix([1, 2, 3, 3], [1, 3, 3, 2], classes=['a', 'b', 'c'], top_k=2, save_to=csv_file)
+        plt.close()
+        df = pd.read_csv(csv_file)
+        self.assertEqual(sorted(zip(df.true, df.pred, df['count'])),
+                         [('a', 'a', 1), ('b', 'c', 1), ('c', 'b', 1), ('c', 'c', 1)])
+        with self.assertRaises(ValueError):
+            plot_confusion_matrix(None, None, classes=['a', 'b'], cm=np.eye(3, dtype=int))
+        ensure_delete(npz_file)
+        ensure_delete(csv_file)
+
+    def test_class_balance_report(self):
+        df = class_balance_df(['b', 'a', 'b', 'c'], sorted=True)
+        self.assertEqual(list(df.label), ['b', 'a', 'c'])
+        self.assertEqual(list(df['count']), [2, 1, 1])
+        self.assertTrue(np.allclose(df.ratio, [0.5, 0.25, 0.25]))
+        df = class_balance_df(np.eye(3)[[0, 2, 2]], labels=['x', 'y', 'z'])
+        self.assertEqual(list(df['count']), [1, 0, 2])
+        df = class_balance_df(np.eye(3)[[0, 2, 2]])
+        self.assertEqual(list(df.label), [0, 2])
+        self.assertEqual(list(df['count']), [1, 2])
+        # Headless mode writes files only
+        folder = self.tmp_folder/'class_balance'
+        for n_classes in [3, 300]:
+            ensure_delete(folder)
+            visualize_class_balance('test', np.arange(1000) % n_classes, save_to=folder/'report')
+            self.assertTrue((folder/'report.png').exists())
+            self.assertEqual(pd.read_csv(folder/'report.csv')['count'].sum(), 1000)
+        ensure_delete(folder)
+
+
+    def test_class_distribution_balance(self):
+        y = [2, 0, 1, 1, 1, 2, 2, 2, 2]
+        self.assertEqual(get_class_distribution(y), {0: 1, 1: 3, 2: 5})
+        self.assertEqual(get_class_distribution(['b', 'a', 'b']), {'a': 1, 'b': 2})
+        self.assertEqual(get_class_distribution(np.eye(3)[[0, 1, 1]]), {0: 1, 1: 2})
+        self.assertEqual(list(get_class_distribution_list(y, 4)), [1, 3, 5, 0])
+
+        X = np.arange(9) * 10
+        bX, by = balance_class_by_over_sampling(X, y)
+        self.assertEqual(get_class_distribution(by), {0: 5, 1: 5, 2: 5})
+        self.assertTrue(np.all(np.array(y)[bX // 10] == by))
+        self.assertEqual(len(set(bX[by == 2])), 5)  # over sampling keeps all original samples
+        index = balance_class_by_under_sampling(X, y, return_index=True)
+        self.assertEqual(get_class_distribution(np.array(y)[index]), {0: 1, 1: 1, 2: 1})
+        df = pd.DataFrame({'x': X, 'y': y})
+        self.assertEqual(get_class_distribution(df_balance_class_by_over_sampling(df, 'y').y), {0: 5, 1: 5, 2: 5})
+        self.assertEqual(get_class_distribution(df_balance_class_by_under_sampling(df, 'y').y), {0: 1, 1: 1, 2: 1})
+
+    def test_class_samplers(self):
+        y = np.repeat(['a', 'b', 'c'], [100, 20, 5])
+        index = sample_class_index(y, {'a': 10, 'c': 30})
+        self.assertEqual(get_class_distribution(y[index]), {'a': 10, 'b': 20, 'c': 30})
+        self.assertTrue(np.all(index == sample_class_index(y, {'a': 10, 'c': 30})))  # deterministic
+        self.assertEqual(get_class_distribution(y[sample_class_index(y, 7)]), {'a': 7, 'b': 7, 'c': 7})
+        index = stratified_sample_index(y, 0.5, random_state=np.random.RandomState(1))
+        self.assertEqual(get_class_distribution(y[index]), {'a': 50, 'b': 10, 'c': 2})
+        self.assertEqual(len(set(index)), len(index))
+        index = stratified_sample_index(y, {'a': 0.1})
+        self.assertEqual(get_class_distribution(y[index]), {'a': 10, 'b': 20, 'c': 5})
+        index = weighted_sample_index(y, 3000)
+        dist = get_class_distribution(y[index])
+        self.assertTrue(all([800 < dist[c] < 1200 for c in 'abc']))
+        index = weighted_sample_index(y, 10, class_weights={'b': 1.0}, replace=False)
+        self.assertTrue(np.all(y[index] == 'b'))
+
+        df = pd.DataFrame({'x': np.arange(len(y)), 'y': y})
+        self.assertEqual(get_class_distribution(df_sample_class(df, 'y', 3).y), {'a': 3, 'b': 3, 'c': 3})
+        self.assertEqual(get_class_distribution(df_stratified_sample(df, 'y', 0.2).y), {'a': 20, 'b': 4, 'c': 1})
+        self.assertEqual(len(df_weighted_sample(df, 'y', 9)), 9)
+
+    def test_import_time(self):
+        # Heavy modules should not be imported until used
+        import subprocess
+        code = ('import time, sys; t = time.time(); from dlcliche.utils import *; t = time.time() - t;'
+                'print(t); print(",".join([m for m in ["pandas", "matplotlib", "matplotlib.pyplot", "IPython",'
+                '"sklearn", "imblearn", "tqdm", "scipy"] if m in sys.modules]));'
+                'print(f1_score([1, 0], [1, 1]))')
+        result = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True,
+                                cwd=str(Path(__file__).parent.parent), universal_newlines=True)
+        seconds, loaded, f1 = result.stdout.splitlines()[-3:]
+        print('dlcliche.utils import time: {} sec'.format(seconds))
+        self.assertEqual(loaded, '')
+        # Lazily imported names work as usual, also with star import
+        self.assertAlmostEqual(float(f1), 2 / 3)
+        self.assertEqual(pd.DataFrame({'a': [1, 2]}).shape, (2, 1))
+        self.assertTrue(callable(plt.subplots))
+        self.assertEqual(accuracy_score([1, 0], [1, 1]), 0.5)
+
+    def test_df_str_replace(self):
+        df = pd.DataFrame({'a': ['foo bar', 'xfoo', None, 3], 'b': [1, 2, 3, 4], 'c': ['foo', '1', 'nan', np.nan]})
+        for num_workers in [None, 2]:
+            d = df.copy()
+            df_str_replace(d, 'fo+', 'Z', num_workers=num_workers)
+            self.assertEqual(list(d.a), ['Z bar', 'xZ', None, 3])
+            self.assertEqual(list(d.b), [1, 2, 3, 4])
+            self.assertEqual(list(d.c[:3]), ['Z', '1', 'nan'])
+        d = df.copy()
+        df_str_replace(d, 'fo+', 'Z', regex=False)
+        self.assertTrue(d.equals(df))
+        df_str_replace(d, 'o', '0', regex=False)
+        self.assertEqual(list(d.a[:2]), ['f00 bar', 'xf00'])
+
+        d = df.copy()
+        df_cell_str_replace(d, '1', 'ONE')
+        df_cell_str_replace(d, 'foo', 'FOO')
+        self.assertEqual(list(d.b), ['ONE', 2, 3, 4])
+        self.assertEqual(list(d.c[:3]), ['FOO', 'ONE', 'nan'])
+        self.assertEqual(list(d.a[:2]), ['foo bar', 'xfoo'])
+
+    def test_df_select_by_keywords(self):
+        df = pd.DataFrame({'one': ['The quick brown fox', 'Tiny dog', 'x.y', None],
+                           'two': ['Little bird', 'Sniffing skunk', 'a', 3]})
+        df2 = df_select_by_keywords(df, {'fox': None, 'skunk': ['two']})
+        self.assertEqual(list(df2.index), [0, 1])
+        mask = df_select_by_keywords(df, {'Tiny': None, 'skunk': ['two']}, and_or='and', as_mask=True)
+        self.assertEqual(list(mask), [False, True, False, False])
+        self.assertEqual(list(df_select_by_keywords(df, {'.': ['one']}, regex=False).index), [2])
+        self.assertEqual(len(df_select_by_keywords(df, {'.': ['one']})), 3)
+        # Keywords never match across columns, and anchors work for each column
+        self.assertEqual(len(df_select_by_keywords(df, {'fox.*Little': None})), 0)
+        self.assertEqual(len(df_select_by_keywords(df, {r'fox\sLittle': None})), 0)
+        self.assertEqual(list(df_select_by_keywords(df, {'^Sniff': ['one', 'two']}).index), [1])
+        # Category and string columns
+        df3 = pd.DataFrame({'c': pd.Categorical(['cat', 'dog']), 's': pd.array(['x', None], dtype='string')})
+        self.assertEqual(list(df_select_by_keywords(df3, {'cat': ['c']}, as_mask=True)), [True, False])
+        self.assertEqual(list(df_select_by_keywords(df3, {'x': ['s']}, as_mask=True)), [True, False])
+        # Case insensitive, with cached index
+        df2 = df_select_by_keywords(df, {'LITTLE': None, 'DOG': ['one']}, case=False, cache=True)
+        self.assertEqual(list(df2.index), [0, 1])
+        self.assertEqual(len(df_select_by_keywords(df, {'LITTLE': None}, cache=True)), 0)
+        # Cache is not used for derived frames
+        sub = df.loc[df.index < 2]
+        mask = df_select_by_keywords(sub, {'little': None}, case=False, cache=True, as_mask=True)
+        self.assertEqual(list(mask), [True, False])
+
+    def test_sjis_csv(self):
+        sjis_file, utf8_file = self.tmp_folder/'sjis.csv', self.tmp_folder/'utf8.csv'
+        text = '名前,値\n東京,1\n大阪,2\n①②,3\n'
+        for encoding in ['cp932', 'utf-8', 'euc_jp']:
+            data = text.replace('①②', 'ab') if encoding == 'euc_jp' else text
+            sjis_file.write_bytes(data.encode(encoding))
+            self.assertEqual(detect_text_encoding(sjis_file), encoding)
+        sjis_file.write_bytes(text.encode('cp932'))
+        df = df_read_sjis_csv(sjis_file)
+        self.assertEqual(list(df.columns), ['名前', '値'])
+        self.assertEqual(list(df['名前']), ['東京', '大阪', '①②'])
+        self.assertEqual([len(d) for d in df_read_sjis_csv(sjis_file, chunksize=2)], [2, 1])
+        # Undecodable bytes are replaced
+        sjis_file.write_bytes(text.encode('cp932') + b'\x85\x40,4\n')
+        self.assertEqual(df_read_sjis_csv(sjis_file)['名前'].iloc[-1], '\ufffd@')
+        transcode_text_file(sjis_file, utf8_file, buffer_bytes=3)
+        self.assertEqual(utf8_file.read_text(encoding='utf-8'), text + '\ufffd@,4\n')
+        ensure_delete(sjis_file)
+        ensure_delete(utf8_file)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,65 @@
+"""Benchmark BigH5Array storage modes.
+
+Compares write throughput, file size and random-batch read latency
+for combinations of chunkshape and compression library.
+
+## Usage
+
+```sh
+$ python /your/path/to/dl-cliche/tool/bench_big_h5_array.py --rows 100000 --cols 256 --batch 64
+```
+"""
+
+from dlcliche.utils import *
+from dlcliche.big_h5_array import *
+import time
+import argparse
+parser = argparse.ArgumentParser(description='BigH5Array storage benchmark')
+parser.add_argument('--rows', default=100000, type=int, help='Number of rows.')
+parser.add_argument('--cols', default=256, type=int, help='Number of columns.')
+parser.add_argument('--batch', default=64, type=int, help='Number of rows to read at once.')
+parser.add_argument('--reads', default=200, type=int, help='Number of random batch reads.')
+parser.add_argument('--cache', default=None, type=int, help='Chunk cache size in bytes.')
+parser.add_argument('--file', default='/tmp/bench_big_h5_array.h5', type=str, help='Temporary file.')
+args = parser.parse_args()
+
+CONFIGS = [
+    # (name, chunkshape, complib)
+    ('default', None, None),
+    ('auto', 'auto', None),
+    ('auto+zlib', 'auto', 'zlib'),
+    ('auto+lz4', 'auto', 'lz4'),
+    ('auto+zstd', 'auto', 'zstd'),
+]
+
+shape = (args.rows, args.cols)
+data = np.random.rand(*shape).astype(np.float32)
+rng = np.random.RandomState(42)
+starts = rng.randint(0, args.rows - args.batch, size=args.reads)
+
+results = []
+for name, chunkshape, complib in CONFIGS:
+    h5array = BigH5Array(args.file, shape, chunkshape=chunkshape, complib=complib,
+                         chunk_cache_size=args.cache, batch_rows=args.batch)
+    t = time.time()
+    h5array.open_for_write()
+    for i in range(0, args.rows, 10000):
+        h5array()[i:i+10000] = data[i:i+10000]
+    h5array.close()
+    write_sec = time.time() - t
+    file_mb = Path(args.file).stat().st_size / 1024 / 1024
+
+    h5array = BigH5Array(args.file, chunk_cache_size=args.cache)
+    h5array.open_for_read()
+    chunk = h5array().chunkshape
+    t = time.time()
+    for s in starts:
+        h5array()[s:s+args.batch]
+    read_ms = (time.time() - t) / args.reads * 1000
+    h5array.close()
+
+    results.append([name, str(chunk), data.nbytes / 1024 / 1024 / write_sec, file_mb, read_ms])
+    ensure_delete(args.file)
+
+df = pd.DataFrame(results, columns=['config', 'chunkshape', 'write MB/s', 'file MB', 'batch read ms'])
+print(df.to_string(index=False))
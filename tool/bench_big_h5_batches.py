@@ -0,0 +1,52 @@
+"""Benchmark reading mini-batches from BigH5Array file.
+
+Compares rows/sec of row-by-row reads against BigH5BatchIterator
+in sequential/shuffled mode, with or without background prefetch.
+`--compute` simulates training step time per batch in seconds.
+
+## Usage
+
+```sh
+$ python /your/path/to/dl-cliche/tool/bench_big_h5_batches.py --rows 100000 --cols 256 --batch 256
+```
+"""
+
+from dlcliche.utils import *
+from dlcliche.big_h5_array import *
+import time
+import argparse
+parser = argparse.ArgumentParser(description='BigH5Array mini-batch read benchmark')
+parser.add_argument('--rows', default=100000, type=int, help='Number of rows.')
+parser.add_argument('--cols', default=256, type=int, help='Number of columns.')
+parser.add_argument('--batch', default=256, type=int, help='Batch size.')
+parser.add_argument('--compute', default=0.0, type=float, help='Simulated compute seconds per batch.')
+parser.add_argument('--file', default='/tmp/bench_big_h5_batches.h5', type=str, help='Temporary file.')
+args = parser.parse_args()
+
+shape = (args.rows, args.cols)
+h5array = BigH5Array(args.file, shape, chunkshape='auto', batch_rows=args.batch)
+h5array.open_for_write()
+for i in range(0, args.rows, 10000):
+    h5array()[i:i+10000] = np.random.rand(min(10000, args.rows - i), args.cols)
+h5array.close()
+
+results = []
+x = BigH5LazyArray(args.file)
+n_rows = min(args.rows, 10000)
+t = time.time()
+for i in range(n_rows):
+    x[i]
+results.append(['row by row', n_rows / (time.time() - t)])
+
+for name, shuffle, prefetch in [('sequential', False, 0), ('sequential+prefetch', False, 4),
+                                ('shuffled', True, 0), ('shuffled+prefetch', True, 4)]:
+    t = time.time()
+    for X in BigH5BatchIterator(x, batch_size=args.batch, shuffle=shuffle, prefetch=prefetch):
+        if 0 < args.compute:
+            time.sleep(args.compute)
+    results.append([name, args.rows / (time.time() - t)])
+x.close()
+ensure_delete(args.file)
+
+df = pd.DataFrame(results, columns=['method', 'rows/sec'])
+print(df.to_string(index=False))
@@ -0,0 +1,75 @@
+"""Benchmark class distribution and balancing utilities.
+
+Compares former list based implementations against current ones.
+
+## Usage
+
+```sh
+$ python /your/path/to/dl-cliche/tool/bench_class_balance.py --samples 5000000 --classes 10000
+```
+"""
+
+from dlcliche.utils import *
+import time
+import argparse
+parser = argparse.ArgumentParser(description='Class distribution/balancing benchmark')
+parser.add_argument('--samples', default=1000000, type=int, help='Number of samples.')
+parser.add_argument('--classes', default=1000, type=int, help='Number of classes.')
+parser.add_argument('--old_samples', default=100000, type=int, help='Number of samples for former implementations.')
+args = parser.parse_args()
+
+
+def old_get_class_distribution(y):
+    """Former implementation of get_class_distribution()."""
+    y_cls = flatten_y_if_onehot(y)
+    classset = sorted(list(set(y_cls)))
+    return {cur_cls:len([one for one in y_cls if one == cur_cls]) for cur_cls in classset}
+
+
+def old_balance_class_by_over_sampling(X, y, random_state=42):
+    """Former _balance_class() via imbalanced-learn, with current imbalanced-learn API."""
+    from imblearn.over_sampling import RandomOverSampler
+    y_cls = flatten_y_if_onehot(y)
+    distribution = old_get_class_distribution(y_cls)
+    nsamples = np.max(list(distribution.values()))
+    Xidx = [[xidx] for xidx in range(len(X))]
+    sampler = RandomOverSampler(sampling_strategy={cls:nsamples for cls in distribution}, random_state=random_state)
+    Xidx_resampled, _ = sampler.fit_resample(Xidx, y_cls)
+    return old_gather(X, y, [idx[0] for idx in Xidx_resampled])
+
+
+def old_gather(X, y, sampled_index):
+    """Former way to make resampled copies in _balance_class()."""
+    return np.array([X[idx] for idx in sampled_index]), np.array([y[idx] for idx in sampled_index])
+
+
+def timeit(fn, *args):
+    t = time.time()
+    fn(*args)
+    return time.time() - t
+
+
+rng = np.random.RandomState(42)
+p = 1 / np.sqrt(np.arange(1, args.classes + 1))  # imbalanced
+y = rng.choice(args.classes, size=args.samples, p=p / p.sum())
+X = rng.rand(args.samples, 8).astype(np.float32)
+y_old = y[:args.old_samples]
+
+results = [
+    ['get_class_distribution', args.old_samples, timeit(old_get_class_distribution, y_old),
+     timeit(get_class_distribution, y_old)],
+    ['get_class_distribution', args.samples, np.nan, timeit(get_class_distribution, y)],
+]
+index = balance_class_by_under_sampling(X, y, return_index=True)
+results.append(['gather resampled X, y', len(index), timeit(old_gather, X, y, index),
+                timeit(lambda: (X[index], y[index]))])
+results.append(['balance_class_by_over_sampling', args.old_samples,
+                timeit(old_balance_class_by_over_sampling, X[:args.old_samples], y_old),
+                timeit(balance_class_by_over_sampling, X[:args.old_samples], y_old)])
+results.append(['balance_class_by_under_sampling(return_index=True)', args.samples, np.nan,
+                timeit(balance_class_by_under_sampling, X, y, 42, True)])
+results.append(['balance_class_by_over_sampling(return_index=True)', args.samples, np.nan,
+                timeit(balance_class_by_over_sampling, X, y, 42, True)])
+
+df = pd.DataFrame(results, columns=['function', 'samples', 'former sec', 'current sec'])
+print(df.to_string(index=False))
@@ -0,0 +1,62 @@
+"""Benchmark df_str_replace() and df_cell_str_replace().
+
+Compares former row by row implementations against current column-wise ones.
+
+## Usage
+
+```sh
+$ python /your/path/to/dl-cliche/tool/bench_df_str_replace.py --rows 1000000 --cols 10
+```
+"""
+
+from dlcliche.utils import *
+import time
+import argparse
+parser = argparse.ArgumentParser(description='df_str_replace benchmark')
+parser.add_argument('--rows', default=1000000, type=int, help='Number of rows.')
+parser.add_argument('--cols', default=10, type=int, help='Number of columns.')
+parser.add_argument('--old_rows', default=5000, type=int, help='Number of rows for former implementations.')
+parser.add_argument('--workers', default=4, type=int, help='Number of processes for parallel mode.')
+args = parser.parse_args()
+
+
+def old_df_str_replace(df, from_strs, to_str):
+    """Former implementation of df_str_replace(), with .loc instead of removed .ix."""
+    for i, row in df.iterrows():
+        df.loc[i] = df.loc[i].str.replace(from_strs, to_str, regex=True)
+
+
+def old_df_cell_str_replace(df, from_str, to_str):
+    """Former implementation of df_cell_str_replace()."""
+    for i, row in df.iterrows():
+        for c in df.columns:
+            df.at[i, c] = to_str if str(df.at[i, c]) == from_str else df.at[i, c]
+
+
+def make_df(rows):
+    rng = np.random.RandomState(42)
+    words = np.array(['apple', 'banana', 'cherry', 'N/A', 'foo-bar', '-'])
+    return pd.DataFrame({'c%d' % c: words[rng.randint(len(words), size=rows)] for c in range(args.cols)})
+
+
+def timeit(fn, df, *prms, **kwargs):
+    df = df.copy()
+    t = time.time()
+    fn(df, *prms, **kwargs)
+    return time.time() - t
+
+
+small, big = make_df(args.old_rows), make_df(args.rows)
+results = [
+    ['df_str_replace', args.old_rows, timeit(old_df_str_replace, small, '-', ' '),
+     timeit(df_str_replace, small, '-', ' ')],
+    ['df_str_replace', args.rows, np.nan, timeit(df_str_replace, big, '-', ' ')],
+    ['df_str_replace num_workers=%d' % args.workers, args.rows, np.nan,
+     timeit(df_str_replace, big, '-', ' ', num_workers=args.workers)],
+    ['df_cell_str_replace', args.old_rows, timeit(old_df_cell_str_replace, small, 'N/A', ''),
+     timeit(df_cell_str_replace, small, 'N/A', '')],
+    ['df_cell_str_replace', args.rows, np.nan, timeit(df_cell_str_replace, big, 'N/A', '')],
+]
+
+df = pd.DataFrame(results, columns=['function', 'rows', 'former sec', 'current sec'])
+print(df.to_string(index=False))
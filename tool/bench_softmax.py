@@ -0,0 +1,54 @@
+"""Benchmark softmax implementations, time and peak memory.
+
+## Usage
+
+```sh
+$ python /your/path/to/dl-cliche/tool/bench_softmax.py --rows 100000 --cols 1000
+```
+"""
+
+from dlcliche.utils import *
+from dlcliche.math import *
+import time
+import tracemalloc
+import argparse
+parser = argparse.ArgumentParser(description='Softmax benchmark')
+parser.add_argument('--rows', default=100000, type=int, help='Number of rows.')
+parser.add_argument('--cols', default=1000, type=int, help='Number of columns.')
+parser.add_argument('--chunk', default=4096, type=int, help='Rows per chunk for chunked version.')
+args = parser.parse_args()
+
+
+def old_np_softmax(z):
+    """Former implementation of np_softmax()."""
+    s = np.max(z, axis=1)
+    s = s[:, np.newaxis]
+    e_x = np.exp(z - s)
+    div = np.sum(e_x, axis=1)
+    div = div[:, np.newaxis]
+    return e_x / div
+
+
+z = np.random.randn(args.rows, args.cols).astype(np.float32)
+out = np.empty_like(z)
+cases = [
+    ('old np_softmax', lambda: old_np_softmax(z)),
+    ('np_softmax', lambda: np_softmax(z)),
+    ('np_softmax out=', lambda: np_softmax(z, out=out)),
+    ('np_softmax_chunked out=', lambda: np_softmax_chunked(z, chunk_rows=args.chunk, out=out)),
+    ('np_softmax inplace', lambda: np_softmax(z, inplace=True)),  # overwrites z, keep this last
+]
+
+results = []
+for name, fn in cases:
+    tracemalloc.start()
+    t = time.time()
+    fn()
+    sec = time.time() - t
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results.append([name, sec, peak / 1024 / 1024])
+
+df = pd.DataFrame(results, columns=['method', 'sec', 'peak MB'])
+print('Input {} {} = {:.1f} MB'.format(z.shape, z.dtype, out.nbytes / 1024 / 1024))
+print(df.to_string(index=False))
@@ -0,0 +1,48 @@
+"""Convert Shift-JIS (cp932) CSV file to UTF-8 CSV or Parquet file in a streaming fashion.
+
+Files larger than memory can be converted; CSV is transcoded buffer by buffer,
+Parquet is written by row groups of `--chunksize` rows, all columns as string.
+Writing Parquet requires pyarrow.
+
+## Usage
+
+```sh
+$ python /your/path/to/dl-cliche/tool/sjis_csv_convert.py legacy_export.csv legacy_export.parquet
+$ python /your/path/to/dl-cliche/tool/sjis_csv_convert.py --encoding auto legacy_export.csv utf8_export.csv
+```
+"""
+
+from dlcliche.utils import *
+import argparse
+parser = argparse.ArgumentParser(description='Shift-JIS CSV converter')
+parser.add_argument('src', type=str, help='Source CSV file.')
+parser.add_argument('dst', type=str, help='Destination .csv or .parquet file.')
+parser.add_argument('--encoding', default='cp932', type=str, help='Source encoding, or auto to detect.')
+parser.add_argument('--errors', default='replace', type=str, help='Decode error handling: strict, replace or ignore.')
+parser.add_argument('--chunksize', default=1000000, type=int, help='Rows per Parquet row group.')
+args = parser.parse_args()
+
+encoding = args.encoding
+if encoding == 'auto':
+    encoding = detect_text_encoding(args.src) or 'cp932'
+    print('Detected encoding:', encoding)
+
+if Path(args.dst).suffix.lower() != '.parquet':
+    transcode_text_file(args.src, args.dst, src_encoding=encoding, errors=args.errors)
+else:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer, n_rows = None, 0
+    for df in df_read_sjis_csv(args.src, encoding=encoding, encoding_errors=args.errors,
+                               chunksize=args.chunksize, dtype=str):
+        if writer is None:
+            # Fixed schema, or a chunk with all-NaN column would be inferred as null type
+            schema = pa.schema([(str(c), pa.string()) for c in df.columns])
+            writer = pq.ParquetWriter(args.dst, schema)
+        df.columns = [str(c) for c in df.columns]
+        writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+        n_rows += len(df)
+        print(f'Wrote {n_rows} rows')
+    if writer is not None:
+        writer.close()
+print('Converted', args.src, 'to', args.dst)